@@ -0,0 +1,334 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+# run in a fresh interpreter so that nothing is already imported or loaded
+STARTUP_SNIPPET = """
+import time
+start = time.perf_counter()
+import model
+imported = time.perf_counter()
+from model import utility
+utility.check_validity([], 1, None)
+loaded = time.perf_counter()
+print(imported - start, loaded - imported)
+"""
+
+
+def _run_startup() -> List[float]:
+    out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], check=True, capture_output=True, text=True)
+    return [float(x) for x in out.stdout.split()]
+
+
+def startup(repeat: int) -> Dict[str, float]:
+    """
+    time to import the model package, and to load the card table on first use
+    from the csv (cold) and from the .npy cache (warm), the submodules being imported on first use.
+    """
+    # imported lazily, the point is to time the first import in the subprocesses
+    from model.utility import REFERENCE_PATH, _table_cache_dir
+    cold, warm, imports = [], [], []
+    for _ in range(repeat):
+        shutil.rmtree(_table_cache_dir(REFERENCE_PATH), ignore_errors=True)
+        import_time, load_time = _run_startup()
+        imports.append(import_time)
+        cold.append(load_time)
+        import_time, load_time = _run_startup()
+        imports.append(import_time)
+        warm.append(load_time)
+    return {'import_s': statistics.median(imports),
+            'first_use_cold_s': statistics.median(cold),
+            'first_use_warm_s': statistics.median(warm)}
+
+
+def _best_of(repeat: int, func) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def topk(batch: int, vocabulary: int, valid_ratio: float, repeat: int) -> Dict[str, float]:
+    """
+    batched partial selection of the top 3 valid cards against a stable sort of every row
+    """
+    import numpy as np
+    from model.topk import select_top_k
+    rng = np.random.default_rng(0)
+    # rounded scores to get ties
+    scores = np.round(rng.random((batch, vocabulary)), 3)
+    mask = rng.random((batch, vocabulary)) < valid_ratio
+
+    def per_row_sort():
+        for row, valid in zip(scores, mask):
+            order = np.argsort(-row, kind='stable')
+            order[valid[order]][:3]
+
+    sort_s = _best_of(repeat, per_row_sort)
+    select_s = _best_of(repeat, lambda: select_top_k(scores, mask, 3))
+    return {'per_row_sort_s': sort_s, 'select_top_k_s': select_s,
+            'per_row_sort_decks_per_s': batch / sort_s, 'select_top_k_decks_per_s': batch / select_s}
+
+
+def _test_decks():
+    """
+    the decks of data/test.csv as fitting data, card28 used as the target
+    """
+    import pandas as pd
+    from model import DeckBatch
+    data = pd.read_csv("data/test.csv")
+    return DeckBatch.from_frame(data.assign(target=data['card28']))
+
+
+def ensemble(n_decks: int, repeat: int) -> Dict[str, float]:
+    """
+    EnsembleKnowledge.predict throughput, fitted on data/test.csv
+    """
+    from model import EnsembleKnowledge
+    decks = _test_decks()
+    model = EnsembleKnowledge()
+    model.fit(decks)
+    test = decks[:n_decks]
+    predict_s = _best_of(repeat, lambda: model.predict(test))
+    return {'decks': len(test), 'predict_s': predict_s, 'decks_per_s': len(test) / predict_s}
+
+
+def synthetic_decks(n_decks: int, seed: int = 0, skew: float = 1.0):
+    """
+    n_decks 30-card decks consistent with the card reference: neutral and hero class cards only,
+    at most one copy of a legendary and two of any other card.
+    Cards are drawn without replacement from the copies allowed, with zipf(skew) popularity in random order.
+    columns: deckid,update_date,hero,card0..29
+    """
+    import numpy as np
+    import pandas as pd
+    from model.utility import get_card_table
+    table = get_card_table()
+    rng = np.random.default_rng(seed)
+    popularity = 1.0 / (rng.permutation(table.cards.shape[0]) + 1.0) ** skew
+    heroes = rng.integers(len(table.heroes), size=n_decks)
+    decks = np.empty((n_decks, 30), dtype=np.int64)
+    for hero in range(len(table.heroes)):
+        rows = np.flatnonzero(heroes == hero)
+        pool = np.flatnonzero((table.class_code == table.NEUTRAL) | (table.class_code == hero))
+        # one slot per allowed copy
+        slots = np.repeat(pool, table.limit[pool])
+        log_weights = np.log(popularity[slots])
+        for start in range(0, rows.shape[0], 1024):
+            block = rows[start:start + 1024]
+            # gumbel top-k: 30 slots drawn without replacement with probabilities proportional to the weights
+            keys = log_weights[None, :] - np.log(-np.log(rng.random((block.shape[0], slots.shape[0]))))
+            drawn = np.argpartition(-keys, 29, axis=1)[:, :30]
+            decks[block] = np.sort(table.cards[slots[drawn]], axis=1)
+    data = pd.DataFrame({'deckid': [f"synthetic-{seed}-{i}" for i in range(n_decks)],
+                         'update_date': np.datetime_as_string(
+                             np.datetime64('2018-01-01') + np.sort(rng.integers(365, size=n_decks)), unit='D'),
+                         'hero': np.array(table.heroes, dtype=object)[heroes]})
+    return pd.concat([data, pd.DataFrame(decks, columns=[f'card{i}' for i in range(30)])], axis=1)
+
+
+MODELS = ['NaiveGraph', 'SimplePopularity', 'SimilarityModel', 'EnsembleKnowledge', 'MatrixFactorization']
+
+
+def _make_model(name: str):
+    import model
+    # nothing written to or read from disk while timing
+    kwargs = {'NaiveGraph': {'export_path': None}, 'EnsembleKnowledge': {'cache_dir': None},
+              'MatrixFactorization': {'embeddings_dir': None}}.get(name, {})
+    return getattr(model, name)(**kwargs)
+
+
+def _peak_mb(func) -> float:
+    """
+    peak memory allocated while running func, numpy arrays included
+    """
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 2 ** 20
+    finally:
+        tracemalloc.stop()
+
+
+def scaling(models: List[str], sizes: List[int], n_predict: int, repeat: int, memory: bool,
+            seed: int) -> Dict:
+    """
+    fit and predict time of every model on synthetic decks of increasing sizes.
+    The first n_predict training decks are predicted, as SimplePopularity fails on unseen cards.
+    The exponents are the slopes of log(time) against log(decks).
+    Peak memory is measured in separate runs, tracemalloc slowing the pure python code down.
+    """
+    import numpy as np
+    from script import create_target
+    results = {'models': {}}
+    for name in models:
+        points = []
+        for n_decks in sizes:
+            train = create_target(synthetic_decks(n_decks, seed))
+            test = train[:n_predict]
+            fitted = {}
+
+            def fit():
+                fitted['model'] = _make_model(name)
+                fitted['model'].fit(train)
+
+            # the models print their progress
+            with contextlib.redirect_stdout(io.StringIO()):
+                fit_s = _best_of(repeat, fit)
+                predict_s = _best_of(repeat, lambda: fitted['model'].predict(test))
+                point = {'decks': n_decks, 'fit_s': fit_s, 'predict_s': predict_s,
+                         'fit_decks_per_s': n_decks / fit_s, 'predict_decks_per_s': len(test) / predict_s}
+                if memory:
+                    point['fit_peak_mb'] = _peak_mb(fit)
+                    point['predict_peak_mb'] = _peak_mb(lambda: fitted['model'].predict(test))
+            points.append(point)
+            print(f"{name} {n_decks} decks: fit {fit_s:.3f}s, predict {predict_s:.3f}s", file=sys.stderr)
+        curve = {'points': points}
+        if len(sizes) > 1:
+            log_decks = np.log([p['decks'] for p in points])
+            curve['fit_exponent'] = float(np.polyfit(log_decks, np.log([p['fit_s'] for p in points]), 1)[0])
+            curve['predict_exponent'] = float(np.polyfit(log_decks, np.log([p['predict_s'] for p in points]), 1)[0])
+        results['models'][name] = curve
+    return results
+
+
+def compare(current: Dict, previous: Dict) -> Dict[str, Dict[str, Dict[str, float]]]:
+    """
+    current / previous time ratios of every (model, size) measured in both runs, above 1 for a slowdown
+    """
+    ratios = {}
+    for name, curve in current['models'].items():
+        before = {p['decks']: p for p in previous['models'].get(name, {}).get('points', [])}
+        for point in curve['points']:
+            if point['decks'] in before:
+                ratios.setdefault(name, {})[str(point['decks'])] = {
+                    key: point[key] / before[point['decks']][key] for key in ('fit_s', 'predict_s')}
+    return ratios
+
+
+def lsh(n_decks: int, n_predict: int, settings: List[str], k: int, seed: int,
+        data_path: Optional[str] = None) -> Dict:
+    """
+    SimilarityModel deck mode (MinHash/LSH neighbours) for every bands x rows setting against the card mode,
+    on the last n_predict decks held out from the others.
+    recall is the share of the exact k nearest decks found by LSH, over the first 256 held-out decks.
+    """
+    import numpy as np
+    import pandas as pd
+    from model import SimilarityModel
+    from model.metrics import hit_at_k
+    from script import create_target
+    frame = synthetic_decks(n_decks, seed) if data_path is None else pd.read_csv(data_path)
+    data = create_target(frame)
+    train, test = data[:len(data) - n_predict], data[len(data) - n_predict:]
+    queries = test.incomplete[:256]
+    results = {'decks': len(train), 'predict': len(test), 'k': k, 'modes': {}}
+
+    def run(name: str, model: SimilarityModel) -> Dict[str, float]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            model.fit(train)
+            fit_s = time.perf_counter() - start
+            start = time.perf_counter()
+            pred = model.predict(test)
+            predict_s = time.perf_counter() - start
+        result = {'fit_s': fit_s, 'predict_decks_per_s': len(test) / predict_s,
+                  'hit_at_3': hit_at_k(pred, test.target)}
+        print(f"{name}: fit {fit_s:.2f}s, predict {result['predict_decks_per_s']:.0f} decks/s, "
+              f"hit@3 {result['hit_at_3']:.4f}", file=sys.stderr)
+        return result
+
+    results['modes']['card'] = run('card', SimilarityModel())
+    exact = None
+    for setting in settings:
+        bands, rows = (int(x) for x in setting.split('x'))
+        model = SimilarityModel(mode='deck', bands=bands, rows=rows, k=k)
+        result = run(setting, model)
+        if exact is None:
+            start = time.perf_counter()
+            exact = model.index.neighbours(queries, k, exact=True)
+            results['exact_query_ms'] = (time.perf_counter() - start) / len(queries) * 1000
+        start = time.perf_counter()
+        found = model.index.neighbours(queries, k)
+        result['query_ms'] = (time.perf_counter() - start) / len(queries) * 1000
+        candidates = model.index._candidates(queries)[0].shape[0]
+        result['candidates_per_query'] = candidates / len(queries)
+        n_decks_index = model.index.decks.shape[0]
+        exact_pairs = exact[0] * n_decks_index + exact[1]
+        result['recall'] = float(np.isin(exact_pairs, found[0] * n_decks_index + found[1]).mean()) \
+            if exact_pairs.shape[0] else 1.0
+        results['modes'][f"deck {setting}"] = result
+    return results
+
+
+def _environment() -> Dict[str, str]:
+    import numpy as np
+    import scipy
+    return {'date': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'machine': platform.machine()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    parser_startup = subparsers.add_parser('startup', help='import time and card table loading')
+    parser_startup.add_argument('--repeat', type=int, default=5)
+    parser_topk = subparsers.add_parser('topk', help='top-3 valid card selection over a score matrix')
+    parser_topk.add_argument('--batch', type=int, default=2000)
+    parser_topk.add_argument('--vocabulary', type=int, default=2600)
+    parser_topk.add_argument('--valid-ratio', dest='valid_ratio', type=float, default=0.6)
+    parser_topk.add_argument('--repeat', type=int, default=5)
+    parser_ensemble = subparsers.add_parser('ensemble', help='EnsembleKnowledge predict throughput')
+    parser_ensemble.add_argument('--decks', type=int, default=500)
+    parser_ensemble.add_argument('--repeat', type=int, default=3)
+    parser_scaling = subparsers.add_parser('scaling', help='fit/predict scaling of the models on synthetic decks')
+    parser_scaling.add_argument('-m', '--models', nargs='+', default=MODELS, choices=MODELS)
+    parser_scaling.add_argument('--sizes', type=int, nargs='+', default=[1000, 4000, 16000])
+    parser_scaling.add_argument('--predict', type=int, default=500, help='number of decks predicted')
+    parser_scaling.add_argument('--repeat', type=int, default=1)
+    parser_scaling.add_argument('--no-memory', dest='memory', action='store_false', help='skip peak memory runs')
+    parser_scaling.add_argument('--seed', type=int, default=0)
+    parser_scaling.add_argument('--output', default=None, help='save the results as json')
+    parser_scaling.add_argument('--compare', default=None, help='json results of a previous run')
+    parser_lsh = subparsers.add_parser('lsh', help='SimilarityModel MinHash/LSH deck mode against the card mode')
+    parser_lsh.add_argument('--decks', type=int, default=20000, help='number of synthetic decks')
+    parser_lsh.add_argument('--data', default=None, help='decks csv used instead of synthetic decks')
+    parser_lsh.add_argument('--predict', type=int, default=1000, help='number of held-out decks predicted')
+    parser_lsh.add_argument('--settings', nargs='+', default=['16x4', '32x4', '64x4', '32x2'],
+                            help='bands x rows of the LSH index')
+    parser_lsh.add_argument('-k', type=int, default=50, help='neighbour decks')
+    parser_lsh.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    if args.benchmark == 'startup':
+        print(json.dumps(startup(args.repeat), indent=2))
+    elif args.benchmark == 'topk':
+        print(json.dumps(topk(args.batch, args.vocabulary, args.valid_ratio, args.repeat), indent=2))
+    elif args.benchmark == 'ensemble':
+        print(json.dumps(ensemble(args.decks, args.repeat), indent=2))
+    elif args.benchmark == 'lsh':
+        results = lsh(args.decks, args.predict, args.settings, args.k, args.seed, args.data)
+        results['environment'] = _environment()
+        print(json.dumps(results, indent=2))
+    elif args.benchmark == 'scaling':
+        results = scaling(args.models, args.sizes, args.predict, args.repeat, args.memory, args.seed)
+        results['environment'] = _environment()
+        results['arguments'] = vars(args)
+        if args.compare is not None:
+            with open(args.compare) as fp:
+                results['ratios'] = compare(results, json.load(fp))
+        if args.output is not None:
+            with open(args.output, "w") as fp:
+                json.dump(results, fp, indent=2)
+        print(json.dumps(results, indent=2))
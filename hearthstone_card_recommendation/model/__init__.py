@@ -1,5 +1,26 @@
-from .abstract_model import RecommendModel
-from .naive_graph import NaiveGraph
-from .simple_popularity import SimplePopularity
-from .ensemble import EnsembleKnowledge
-from .similarity import SimilarityModel
+import importlib
+
+# the submodules, and pandas and scipy with them, are only imported when one of their classes is first used
+_SUBMODULES = {
+    'DeckBatch': 'decks',
+    'Profiler': 'profiling',
+    'RecommendModel': 'abstract_model',
+    'NaiveGraph': 'naive_graph',
+    'SimplePopularity': 'simple_popularity',
+    'EnsembleKnowledge': 'ensemble',
+    'SimilarityModel': 'similarity',
+    'MatrixFactorization': 'matrix_factorization',
+}
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name: str):
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(f".{_SUBMODULES[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
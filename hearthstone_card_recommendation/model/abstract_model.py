@@ -1,17 +1,82 @@
 from abc import ABC, abstractmethod
-from typing import List
+from typing import Callable, List, Optional, Tuple, Union
+import numpy as np
 import pandas as pd
+from .candidates import HeroCandidates
+from .decks import DeckBatch
+from .profiling import Profiler, NULL_PROFILER
+from .topk import top_k_cards
 
 
 class RecommendModel(ABC):
+    # attributes only needed by fit, left out when the model is sent to prediction workers
+    fit_only_attributes: Tuple[str, ...] = ()
+    # stage timings and counters, nothing is recorded unless enable_profiling is called
+    profiler: Profiler = NULL_PROFILER
+    # print the progress of predict, batch by batch
+    verbose: bool = False
+
+    def enable_profiling(self, profiler: Optional[Profiler] = None) -> Profiler:
+        self.profiler = Profiler() if profiler is None else profiler
+        return self.profiler
+
     @abstractmethod
-    def fit(self, data: pd.DataFrame):
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
         """
         columns: deckid,update_date,hero,card0..28, target
         """
 
     @abstractmethod
-    def predict(self, data: pd.DataFrame) -> List[List[int]]:
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        update the model with one more chunk of the training decks, same columns as fit.
+        Fitting chunk by chunk gives the same model as fit on all the chunks at once.
+        """
+
+    def finalize(self):
+        """
+        complete the fitting after the last partial_fit, predict calls it when needed.
+        """
+
+    def fitted_copy(self) -> 'RecommendModel':
+        """
+        a shallow copy of the finalized model without its fit_only_attributes, all that predict needs.
+        Used to pickle a fitted model for the prediction workers or the recommendation service.
+        """
+        self.finalize()
+        fitted = self.__class__.__new__(self.__class__)
+        fitted.__dict__.update({k: v for k, v in self.__dict__.items() if k not in self.fit_only_attributes})
+        return fitted
+
+    @abstractmethod
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
         """
         columns: deckid,update_date,hero,card0..28
         """
+
+    def _predict_by_hero(self, data: DeckBatch, cards: np.ndarray, candidates: HeroCandidates, batch_size: int,
+                         score: Callable[[DeckBatch], np.ndarray]) -> List[List[int]]:
+        """
+        the top 3 valid cards of every deck, score giving the (batch, n_vocab) scores of all the cards for a batch.
+        Every batch of batch_size decks is scored once whatever the heroes of its decks, then the decks of every hero
+        only check and select among the cards of its class and the neutral cards.
+        """
+        pred: List[List[int]] = [[] for _ in range(len(data))]
+        for start in range(0, len(data), batch_size):
+            batch = data[start:start + batch_size]
+            scores = score(batch)
+            with self.profiler.stage('predict.validity'):
+                copies = candidates.copies(batch.incomplete)
+            for rows, columns in candidates.groups(batch.heroes):
+                candidate_cards = cards[columns]
+                with self.profiler.stage('predict.validity'):
+                    masks = candidates.valid_mask(copies[rows], columns)
+                with self.profiler.stage('predict.top_k'):
+                    recommendations = top_k_cards(candidate_cards, scores[np.ix_(rows, columns)], masks)
+                    for i, recommendation in zip((rows + start).tolist(), recommendations):
+                        pred[i] = recommendation
+                self.profiler.count('validity_checks', masks.size)
+            self.profiler.count('candidates_scored', scores.size)
+            if self.verbose:
+                print(f"Prediction progress {start + len(batch)} / {len(data)}")
+        return pred
@@ -0,0 +1,138 @@
+import hashlib
+import os
+import shutil
+from typing import Dict, Optional, Tuple
+import numpy as np
+from .decks import DeckBatch
+
+DEFAULT_CACHE_DIR = "data/.cache/artifacts"
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+class DeckDigest:
+    """
+    Hash of the training decks, fed in any number of chunks.
+    Every column is hashed separately, so the digest only depends on the decks and their order.
+    hexdigest folds the hash objects into a string, which can be pickled unlike them:
+    the decks fed after it are hashed on top of that string.
+    """
+    def __init__(self):
+        self._digest = ''
+        self._hashes: Optional[Tuple] = None
+
+    def update(self, data: DeckBatch):
+        if self._hashes is None:
+            self._hashes = (hashlib.sha256(), hashlib.sha256(), hashlib.sha256())
+        cards, deck_ids, dates = self._hashes
+        cards.update(np.ascontiguousarray(data.cards, dtype='<i4').tobytes())
+        deck_ids.update(''.join(f"{deck_id}\n" for deck_id in data.deck_ids.tolist()).encode())
+        dates.update(np.ascontiguousarray(data.dates, dtype='<i4').tobytes())
+
+    def hexdigest(self) -> str:
+        if self._hashes is not None:
+            digests = b''.join(h.digest() for h in self._hashes)
+            self._digest = hashlib.sha256(self._digest.encode() + digests).hexdigest()
+            self._hashes = None
+        return self._digest
+
+
+def file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fp:
+        for block in iter(lambda: fp.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ArtifactCache:
+    """
+    Fitted arrays stored under a key that hashes the training inputs and the model parameters,
+    one directory of .npy files per key, memory-mapped when loaded.
+    The least recently used entries are evicted once the cache grows beyond max_bytes.
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, verbose: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(repr(part).encode())
+            digest.update(b'\0')
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _report(self, status: str, name: str, key: str):
+        if self.verbose:
+            print(f"artifact cache {status}: {name} {key[:12]}")
+
+    def load(self, key: str, name: str = '') -> Optional[Dict[str, np.ndarray]]:
+        """
+        the arrays saved under key, None on a miss
+        """
+        path = self._path(key)
+        try:
+            arrays = {f[:-len('.npy')]: np.load(os.path.join(path, f), mmap_mode='r')
+                      for f in os.listdir(path) if f.endswith('.npy')}
+            # the modification time orders the entries for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            arrays = None
+        if arrays is None:
+            self.misses += 1
+            self._report('miss', name, key)
+            return None
+        self.hits += 1
+        self._report('hit', name, key)
+        return arrays
+
+    def save(self, key: str, arrays: Dict[str, np.ndarray]):
+        """
+        written to a temporary directory renamed at the end, so that a partial entry is never loaded
+        """
+        path = self._path(key)
+        tmp = f"{path}.tmp{os.getpid()}"
+        try:
+            os.makedirs(tmp, exist_ok=True)
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.asarray(array))
+            if os.path.exists(path):
+                shutil.rmtree(path)
+            os.rename(tmp, path)
+        except OSError:
+            # read-only data directory, the arrays are only kept in memory
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        self.evict(keep=key)
+
+    def entries(self) -> Dict[str, int]:
+        """
+        key -> size in bytes, from the least to the most recently used
+        """
+        if not os.path.isdir(self.directory):
+            return {}
+        entries = []
+        for key in os.listdir(self.directory):
+            path = self._path(key)
+            if '.tmp' in key or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), key, size))
+        return {key: size for _, key, size in sorted(entries)}
+
+    def evict(self, keep: Optional[str] = None):
+        entries = self.entries()
+        total = sum(entries.values())
+        for key, size in entries.items():
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(self._path(key), ignore_errors=True)
+            total -= size
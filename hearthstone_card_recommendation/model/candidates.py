@@ -0,0 +1,64 @@
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .utility import CardTable, get_card_table, encode_cards, count_copies
+
+
+class HeroCandidates:
+    """
+    The columns of a card vocabulary that can be recommended to each hero: the neutral cards and the cards
+    of its class, in vocabulary order. Cards missing from the card reference are never candidates.
+    Selecting among these columns gives the same recommendations as among the whole vocabulary,
+    only the copy limits being left to check, by valid_mask.
+    """
+    def __init__(self, cards: np.ndarray, table: Optional[CardTable] = None):
+        table = get_card_table() if table is None else table
+        self.cards = np.asarray(cards, dtype=np.int64)
+        self._sorter = np.argsort(self.cards, kind='stable')
+        ids = table.encode(cards)
+        self.known = ids >= 0
+        self.class_code = np.asarray(table.class_code)[np.where(self.known, ids, 0)]
+        # copies of every card allowed in a deck, 0 for the cards missing from the reference
+        self.limit = np.where(self.known, np.asarray(table.limit)[np.where(self.known, ids, 0)], 0)
+        self.hero_index = dict(table.hero_index)
+        self._columns: Dict[int, np.ndarray] = {}
+
+    def encode_heroes(self, heroes: Sequence[Optional[str]]) -> np.ndarray:
+        """
+        same codes as CardTable.encode_heroes
+        """
+        unknown = len(self.hero_index)
+        return np.array([CardTable.ANY_HERO if h is None else self.hero_index.get(h, unknown) for h in heroes],
+                        dtype=np.int16)
+
+    def _columns_of(self, code: int) -> np.ndarray:
+        if code not in self._columns:
+            allowed = self.known if code == CardTable.ANY_HERO \
+                else self.known & ((self.class_code == CardTable.NEUTRAL) | (self.class_code == code))
+            self._columns[code] = np.flatnonzero(allowed)
+        return self._columns[code]
+
+    def columns(self, hero: Optional[str]) -> np.ndarray:
+        return self._columns_of(int(self.encode_heroes([hero])[0]))
+
+    def groups(self, heroes: Sequence[Optional[str]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        (rows, columns) for every hero of the decks: the rows of its decks, in order, and its candidate columns
+        """
+        codes = self.encode_heroes(heroes)
+        order = np.argsort(codes, kind='stable')
+        distinct, starts = np.unique(codes[order], return_index=True)
+        return [(rows, self._columns_of(int(code)))
+                for code, rows in zip(distinct.tolist(), np.split(order, starts[1:]))]
+
+    def copies(self, decks: np.ndarray) -> np.ndarray:
+        """
+        (batch, n_vocab) number of copies of every card of the vocabulary in each deck
+        """
+        return count_copies(encode_cards(self.cards, self._sorter, decks), self.cards.shape[0])[:, :-1]
+
+    def valid_mask(self, copies: np.ndarray, columns: np.ndarray) -> np.ndarray:
+        """
+        copies: the copies of the decks of one hero, columns: the candidate columns of that hero.
+        (batch, n_candidates) the same mask as valid_mask_batch, the candidates being in the reference and of its class
+        """
+        return copies[:, columns] < self.limit[columns]
@@ -0,0 +1,106 @@
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.csgraph import connected_components
+
+# (cards, labels): the sorted ids of the clustered cards and the cluster id of each of them
+Clusters = Tuple[np.ndarray, np.ndarray]
+
+
+class UnionFind:
+    """
+    Disjoint sets over 0..n-1, union by size with path halving.
+    """
+    def __init__(self, n: int):
+        self.parent = list(range(n))
+        self.size = [1] * n
+
+    def find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def union(self, a: int, b: int) -> int:
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.size[a] < self.size[b]:
+            a, b = b, a
+        self.parent[b] = a
+        self.size[a] += self.size[b]
+        return a
+
+    def roots(self, nodes: Sequence[int]) -> np.ndarray:
+        return np.array([self.find(x) for x in nodes], dtype=np.int64)
+
+
+def _canonical(labels: np.ndarray) -> np.ndarray:
+    """
+    renumber the clusters 0..k-1 in order of their first member
+    """
+    _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+    rank = np.empty(first.shape[0], dtype=np.int64)
+    rank[np.argsort(first, kind='stable')] = np.arange(first.shape[0])
+    return rank[inverse.ravel()]
+
+
+def _strong_edges(c1: np.ndarray, c2: np.ndarray, weight: np.ndarray, threshold: float) -> Tuple[np.ndarray, np.ndarray]:
+    keep = weight > threshold
+    return np.asarray(c1)[keep], np.asarray(c2)[keep]
+
+
+def find_clusters(c1: np.ndarray, c2: np.ndarray, weight: np.ndarray, threshold: float) -> Clusters:
+    """
+    connected components of the graph made of the edges (c1, c2) heavier than threshold.
+    Only the cards of these edges are clustered.
+    """
+    c1, c2 = _strong_edges(c1, c2, weight, threshold)
+    cards, codes = np.unique(np.concatenate([c1, c2]), return_inverse=True)
+    codes = codes.ravel()
+    n_edges = c1.shape[0]
+    graph = sp.csr_matrix((np.ones(n_edges), (codes[:n_edges], codes[n_edges:])), shape=(cards.shape[0],) * 2)
+    _, labels = connected_components(graph, directed=False)
+    return cards, _canonical(labels)
+
+
+def sweep_clusters(c1: np.ndarray, c2: np.ndarray, weight: np.ndarray,
+                   thresholds: Sequence[float]) -> Dict[float, Clusters]:
+    """
+    find_clusters for several thresholds in one pass: the edges are merged with a union-find
+    from the heaviest to the lightest, and the clusters are read every time a threshold is crossed.
+    """
+    c1, c2, weight = np.asarray(c1), np.asarray(c2), np.asarray(weight)
+    cards, codes = np.unique(np.concatenate([c1, c2]), return_inverse=True)
+    codes = codes.ravel()
+    n_edges = c1.shape[0]
+    order = np.argsort(-weight, kind='stable')
+    sources, destinations, weight = codes[:n_edges][order].tolist(), codes[n_edges:][order].tolist(), weight[order]
+    union_find = UnionFind(cards.shape[0])
+    active = np.zeros(cards.shape[0], dtype=bool)
+    ret: Dict[float, Clusters] = {}
+    merged = 0
+    for threshold in sorted(thresholds, reverse=True):
+        # edges strictly heavier than the threshold
+        stop = int(np.searchsorted(-weight, -threshold, side='left'))
+        for a, b in zip(sources[merged:stop], destinations[merged:stop]):
+            union_find.union(a, b)
+        active[sources[merged:stop]] = True
+        active[destinations[merged:stop]] = True
+        merged = max(merged, stop)
+        nodes = np.flatnonzero(active)
+        ret[threshold] = (cards[nodes], _canonical(union_find.roots(nodes.tolist())))
+    return ret
+
+
+def cluster_members(clusters: Clusters) -> List[np.ndarray]:
+    """
+    the card ids of every cluster, indexed by cluster id
+    """
+    cards, labels = clusters
+    if labels.shape[0] == 0:
+        return []
+    order = np.argsort(labels, kind='stable')
+    bounds = np.cumsum(np.bincount(labels))[:-1]
+    return np.split(cards[order], bounds)
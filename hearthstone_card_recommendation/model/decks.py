@@ -0,0 +1,95 @@
+from typing import List, Optional, Union
+import numpy as np
+import pandas as pd
+
+CARD_COLUMNS = [f'card{i}' for i in range(29)]
+NO_CARD = -1
+
+
+class DeckBatch:
+    """
+    Columnar representation of decks, converted once from the csv columns.
+    cards: (n_decks, 30) int32, card0..28 then the target, NO_CARD when there is no target
+    deck_ids: (n_decks,) deck ids
+    hero_codes: (n_decks,) int16 codes into hero_names, -1 for a missing hero
+    dates: (n_decks,) int32 days since 1970-01-01 of update_date
+    """
+    def __init__(self, cards: np.ndarray, deck_ids: np.ndarray, hero_codes: np.ndarray, hero_names: List[str],
+                 dates: np.ndarray, has_target: bool):
+        self.cards = cards
+        self.deck_ids = deck_ids
+        self.hero_codes = hero_codes
+        self.hero_names = list(hero_names)
+        self.dates = dates
+        self.has_target = has_target
+
+    @classmethod
+    def from_columns(cls, incomplete: np.ndarray, target: Optional[np.ndarray], deck_ids, heroes,
+                     update_dates) -> 'DeckBatch':
+        """
+        incomplete: (n_decks, 29) card ids, target: (n_decks,) card ids or None,
+        heroes: hero names, update_dates: 'YYYY-MM-DD' strings
+        """
+        n = incomplete.shape[0]
+        cards = np.full((n, 30), NO_CARD, dtype=np.int32)
+        cards[:, :29] = incomplete
+        if target is not None:
+            cards[:, 29] = target
+        heroes = pd.Categorical(heroes)
+        dates = pd.to_datetime(pd.Series(update_dates), format='%Y-%m-%d').to_numpy().astype('datetime64[D]')
+        return cls(cards, np.asarray(deck_ids), heroes.codes.astype(np.int16), heroes.categories.tolist(),
+                   dates.astype(np.int32), target is not None)
+
+    @classmethod
+    def from_frame(cls, data: pd.DataFrame) -> 'DeckBatch':
+        """
+        columns: deckid,update_date,hero,card0..28 and optionally target
+        """
+        target = data['target'].to_numpy(dtype=np.int32) if 'target' in data.columns else None
+        return cls.from_columns(data[CARD_COLUMNS].to_numpy(dtype=np.int32), target, data['deckid'].to_numpy(),
+                                data['hero'].to_numpy(), data['update_date'].to_numpy())
+
+    @classmethod
+    def coerce(cls, data: Union[pd.DataFrame, 'DeckBatch']) -> 'DeckBatch':
+        if isinstance(data, DeckBatch):
+            return data
+        return cls.from_frame(data)
+
+    def __len__(self) -> int:
+        return self.cards.shape[0]
+
+    def __getitem__(self, rows) -> 'DeckBatch':
+        """
+        a sub-batch, rows being a slice, a mask or an array of positions
+        """
+        return DeckBatch(self.cards[rows], self.deck_ids[rows], self.hero_codes[rows], self.hero_names,
+                         self.dates[rows], self.has_target)
+
+    @property
+    def incomplete(self) -> np.ndarray:
+        """
+        (n_decks, 29) the known cards
+        """
+        return self.cards[:, :29]
+
+    @property
+    def target(self) -> np.ndarray:
+        return self.cards[:, 29]
+
+    @property
+    def heroes(self) -> List[Optional[str]]:
+        names = self.hero_names + [None]
+        return [names[c] for c in self.hero_codes.tolist()]
+
+    @property
+    def update_dates(self) -> np.ndarray:
+        return self.dates.astype('datetime64[D]')
+
+    def to_frame(self) -> pd.DataFrame:
+        data = pd.DataFrame({'deckid': self.deck_ids,
+                             'update_date': np.datetime_as_string(self.update_dates, unit='D'),
+                             'hero': self.heroes})
+        cards = pd.DataFrame(self.incomplete, columns=CARD_COLUMNS)
+        if self.has_target:
+            cards['target'] = self.target
+        return pd.concat([data, cards], axis=1)
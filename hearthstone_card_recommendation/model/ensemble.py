@@ -1,12 +1,16 @@
-import json
-import statistics
-import os
-
-from . import RecommendModel
+from .abstract_model import RecommendModel
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple, Optional, Set
-from datetime import datetime
-from .utility import check_validity, jaccard_similarity_score
+import scipy.sparse as sp
+from typing import List, Dict, Tuple, Optional, Set, Union
+from .candidates import HeroCandidates
+from .artifacts import ArtifactCache, DeckDigest, file_digest, DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from .clustering import find_clusters, cluster_members
+from .decks import DeckBatch
+from .incidence import CardIncidence
+from .popularity import PopularityCounter, Decay
+from .similarity_index import SimilarityIndex
+from .utility import encode_cards, count_copies
 
 
 class EnsembleKnowledge(RecommendModel):
@@ -17,187 +21,352 @@ class EnsembleKnowledge(RecommendModel):
     Popularity: how popular this card is in the recent months
     Combo cluster: whether there are other cards in a combo cluster in the deck
     """
-    def __init__(self):
-        # common variables
+    BAKU = 89335
+    GENN = 89336
+    # (card, score, hero) recommended for no-duplicate decks, None for any hero
+    HIGHLANDER = [(1024971, 10.0, None), (49622, 10.0, None),
+                  (49744, 5.0, 'warlock'), (49693, 5.0, 'mage'), (49702, 5.0, 'priest')]
+    fit_only_attributes = ('cards_profile', '_deck_columns', 'popularity_counter', '_digest')
+    verbose = True
+
+    def __init__(self, batch_size: int = 256, top_k: Optional[int] = None, index_path: Optional[str] = None,
+                 combo_threshold: float = 0.5, cache_dir: Optional[str] = DEFAULT_CACHE_DIR,
+                 cache_size: int = DEFAULT_MAX_BYTES, popularity_decay: Union[str, Decay] = 'linear',
+                 popularity_half_life: float = 30.0, popularity_window: Optional[int] = None):
+        """
+        top_k: neighbours kept per card in the synergy index, None for the exact dense index on small vocabularies
+        index_path: where the synergy index is saved after fitting (.npz)
+        combo_threshold: jaccard similarity above which two cards are linked in a combo cluster
+        cache_dir: artifact cache of the synergy index and the popularity, keyed by the training decks, None to disable
+        cache_size: bytes kept in the artifact cache
+        popularity_decay, popularity_half_life, popularity_window: recency weight of the decks, see PopularityCounter
+        """
+        # common variables, the combo signal is opt-in: it did not improve hit@3 in cross-validation
         self.weights = {'synergy': 10.0, 'mana': 0.1, 'popularity': 0.5, 'combo': 0.0}
+        self.batch_size = batch_size
+        self.cache = ArtifactCache(cache_dir, cache_size) if cache_dir is not None else None
+        # hash of the training decks, the key of the cached artifacts
+        self._digest = DeckDigest()
+        self._pending = False
         # synergy-related variables
-        self.cards_profile: Dict[int, Set] = {}
+        self.top_k = top_k
+        self.index_path = index_path
+        # profile of every card: the decks that include it, one column per deck id
+        self.cards_profile: Optional[CardIncidence] = None
+        self._deck_columns: Dict[str, int] = {}
+        self.synergy_index: Optional[SimilarityIndex] = None
         # mana-related variables
         self.mana: Dict[int, int] = {}
         # popularity-related variables
         self.popularity: Dict[int, float] = {}
+        self.popularity_decay = popularity_decay
+        self.popularity_half_life = popularity_half_life
+        self.popularity_window = popularity_window
+        self.popularity_counter = self._popularity_counter()
+        # cards scored at prediction, see _build_card_index
+        self.cards = np.zeros(0, dtype=np.int64)
+        # candidate columns of self.cards for every hero
+        self.candidates: Optional[HeroCandidates] = None
         # combo-cluster-related variables
+        self.combo_threshold = combo_threshold
+        # cluster id of every card of self.synergy_index.cards, -1 outside of any cluster
+        self.combo_cluster = np.zeros(0, dtype=np.int64)
+        # card ids of the members of every cluster
+        self.combo_members: List[np.ndarray] = []
 
-    def _update_popularity(self, card: int, w: float):
-        if card not in self.popularity:
-            self.popularity[card] = w
-        else:
-            self.popularity[card] += w
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        columns: deckid,update_date,hero,card0..28, target
+        """
+        self._digest = DeckDigest()
+        self.cards_profile = None
+        self._deck_columns = {}
+        self.popularity_counter = self._popularity_counter()
+        self.partial_fit(data)
+        self.finalize()
 
-    def fit(self, data: pd.DataFrame):
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
         """
         columns: deckid,update_date,hero,card0..28, target
+        only the card profiles and the popularity counts are updated, the rest is fitted by finalize.
+        """
+        data = DeckBatch.coerce(data)
+        with self.profiler.stage('partial_fit.digest'):
+            self._digest.update(data)
+        with self.profiler.stage('partial_fit.synergy'):
+            self._update_profiles(data.cards, data.deck_ids)
+        with self.profiler.stage('partial_fit.popularity'):
+            self.popularity_counter.update(data.cards, data.dates)
+        self.profiler.count('decks_fitted', len(data))
+        self._pending = True
+
+    def finalize(self):
+        if not self._pending:
+            return
+        with self.profiler.stage('finalize.synergy'):
+            self._synergy_fit()
+        with self.profiler.stage('finalize.mana'):
+            self._mana_fit()
+        with self.profiler.stage('finalize.popularity'):
+            self._popularity_fit()
+        with self.profiler.stage('finalize.combo'):
+            self._combo_cluster_fit()
+        with self.profiler.stage('finalize.card_index'):
+            self._build_card_index()
+        self._pending = False
+
+    def _load_artifacts(self, key: str, name: str) -> Optional[Dict[str, np.ndarray]]:
+        if self.cache is None:
+            return None
+        arrays = self.cache.load(key, name)
+        self.profiler.count('cache_hits' if arrays is not None else 'cache_misses')
+        return arrays
+
+    def _update_profiles(self, cards: np.ndarray, deck_ids: np.ndarray):
+        columns = np.fromiter((self._deck_columns.setdefault(deck_id, len(self._deck_columns))
+                               for deck_id in deck_ids.tolist()), dtype=np.int64, count=deck_ids.shape[0])
+        if self.cards_profile is None:
+            self.cards_profile = CardIncidence.from_decks(cards, columns)
+        else:
+            self.cards_profile = self.cards_profile.extend(cards, columns)
+
+    def _synergy_fit(self):
+        """
+        the synergy index of the profiles of the training and test decks, from the artifact cache if possible
+        """
+        key = ArtifactCache.key('EnsembleKnowledge.synergy', self._digest.hexdigest(), file_digest("data/test.csv"),
+                                self.top_k)
+        arrays = self._load_artifacts(key, 'synergy index')
+        if arrays is not None:
+            self.synergy_index = SimilarityIndex.from_arrays(arrays)
+        else:
+            test_data = DeckBatch.from_frame(pd.read_csv("data/test.csv"))
+            self._update_profiles(test_data.incomplete, test_data.deck_ids)
+            self.synergy_index = SimilarityIndex.build(self.cards_profile, self.top_k)
+            if self.cache is not None:
+                self.cache.save(key, self.synergy_index.arrays())
+        if self.index_path is not None:
+            self.synergy_index.save(self.index_path)
+
+    def load_synergy_index(self, path: str):
         """
-        self._synergy_fit(data)
-        self._mana_fit(data)
-        self._popularity_fit(data)
-        self._combo_cluster_fit(data)
-
-    def _synergy_fit(self, data: pd.DataFrame):
-        filename = "data/saved_card_profiles.json"
-        if os.path.exists(filename):
-            with open(filename, "r") as fp:
-                self.cards_profile = json.load(fp)
-                self.cards_profile = {int(k): set(v) for k, v in self.cards_profile.items()}
-                return
-        for i, row in data.iterrows():
-            cards = row[[f'card{j}' for j in range(29)] + ['target']]
-            deck_id = row['deckid']
-            for card in cards:
-                if card in self.cards_profile:
-                    self.cards_profile[card].add(deck_id)
-                else:
-                    self.cards_profile[card] = {deck_id}
-        test_data = pd.read_csv("data/test.csv")
-        for i, row in test_data.iterrows():
-            cards = row[[f'card{j}' for j in range(29)]]
-            deck_id = row['deckid']
-            for card in cards:
-                if card in self.cards_profile:
-                    self.cards_profile[card].add(deck_id)
-                else:
-                    self.cards_profile[card] = {deck_id}
-        with open(filename, "w") as fp:
-            tmp = {k: list(v) for k, v in self.cards_profile.items()}
-            json.dump(tmp, fp)
-
-    def _synergy_predict(self, incomplete_deck: List[int], hero: str, date: str) -> Dict[int, float]:
+        replace the synergy index of a fitted model by one saved by fit, the combo clusters and the card index
+        are rebuilt on it. The mana and the popularity still come from fitting.
+        """
+        self.finalize()
+        if not self.popularity:
+            raise ValueError("load_synergy_index needs a fitted EnsembleKnowledge")
+        self.synergy_index = SimilarityIndex.load(path)
+        self._combo_cluster_fit()
+        self._build_card_index()
+
+    def _synergy_predict(self, incomplete_decks: np.ndarray, copies: np.ndarray, columns: Optional[np.ndarray] = None,
+                         similarity=None) -> np.ndarray:
         """
         look for cards that have similar profiles to the ones in the deck.
         A card profile is a set of deck-ids that include this card.
         """
-        rankings: Dict[int, float] = {}
-        for card, profile in self.cards_profile.items():
-            tmp = [jaccard_similarity_score(self.cards_profile[t], profile) for t in
-                   list(set(incomplete_deck)) if t != card and t in self.cards_profile]
-            rankings[card] = sum(tmp) / len(tmp)
-        return rankings
+        if columns is None:
+            scores = np.zeros(copies.shape, dtype=np.float64)
+            scores[:, self._synergy_columns] = self.synergy_index.mean_jaccard(incomplete_decks)
+            return scores
+        scores = np.zeros((copies.shape[0], columns.shape[0]), dtype=np.float64)
+        index_columns = self._index_columns[columns]
+        scored = index_columns >= 0
+        scores[:, scored] = self.synergy_index.mean_jaccard(incomplete_decks, index_columns[scored], similarity)
+        return scores
+
+    def candidate_similarity(self, columns: np.ndarray):
+        """
+        the synergy similarities to the cards of columns that are in the synergy index
+        """
+        index_columns = self._index_columns[columns]
+        return self.synergy_index.candidate_similarity(index_columns[index_columns >= 0])
 
-    def _mana_fit(self, data: pd.DataFrame):
-        for i, row in pd.read_csv("data/cards_2018.csv", index_col='id').iterrows():
-            self.mana[row.name] = row['cost']
+    def _mana_fit(self):
+        cards = pd.read_csv("data/cards_2018.csv", index_col='id')
+        self.mana = dict(zip(cards.index.tolist(), cards['cost'].tolist()))
 
-    def _mana_predict(self, incomplete_deck: List[int], hero: str, date: str) -> Dict[int, float]:
+    def _mana_predict(self, incomplete_decks: np.ndarray, copies: np.ndarray, columns: np.ndarray) -> np.ndarray:
         """
         check all-even or all-odd deck.
         Otherwise it favors the cards that are within the range of the card costs from the deck.
         """
-        deck_costs = [self.mana[c] for c in incomplete_deck if c in self.mana]
-        min_cost = min(deck_costs)
-        max_cost = max(deck_costs)
-        median_cost = statistics.median(deck_costs)
-        all_odd = all([c % 2 == 1 for c in deck_costs])
-        all_even = all([c % 2 == 0 for c in deck_costs])
-        # if all cards are odd-cost but Baku is not in the deck
-        if all_odd and 89335 not in incomplete_deck:
-            ret = {89335: 10}
-            return ret
-        # if all cards are even-cost but Genn is not in the deck
-        if all_even and 89336 not in incomplete_deck:
-            ret = {89336: 10}
-            return ret
-
-        def mana2score(mana: int) -> float:
-            if all_odd and mana % 2 == 0:
-                return -5.0
-            if all_even and mana % 2 == 1:
-                return -5.0
-            if max_cost >= mana >= min_cost:
-                return 1.0
-            else:
-                return 0.0
-
-        return {k: mana2score(v) for k, v in self.mana.items()}
-
-    def _popularity_fit(self, data: pd.DataFrame):
-        fname = "data/saved_popularity.json"
-        if os.path.exists(fname):
-            with open(fname, "r") as fp:
-                self.popularity = json.load(fp)
-                self.popularity = {int(k): v for k, v in self.popularity.items()}
-                return
-        date_begin = datetime.strptime(data['update_date'].min(), '%Y-%m-%d')
-        date_end = datetime.strptime(data['update_date'].max(), '%Y-%m-%d')
-        max_diff_days = (date_end - date_begin).days
-        for i, row in data.iterrows():
-            date = datetime.strptime(row['update_date'], '%Y-%m-%d')
-            diff_days = (date - date_begin).days
-            weight = diff_days / max_diff_days
-            deck = row[[f'card{j}' for j in range(29)] + ['target']].to_list()
-            for card in list(set(deck)):
-                self._update_popularity(card, weight)
-        max_popularity = max(self.popularity.values())
-        self.popularity = {k: v / max_popularity for k, v in self.popularity.items()}
-        with open(fname, "w") as fp:
-            json.dump(self.popularity, fp)
-
-    def _popularity_predict(self, incomplete_deck: List[int], hero: str, date: str) -> Dict[int, float]:
-        counts = pd.Series(incomplete_deck).value_counts()
-        scores: Dict[int, float] = {}
-        if all(counts == 1):
-            # no-duplicate deck, recommend Reno and Kazakus
-            if 1024971 not in incomplete_deck:
-                scores[1024971] = 10
-            if 49622 not in incomplete_deck:
-                scores[49622] = 10
-            if 49744 not in incomplete_deck and hero == 'warlock':
-                scores[49744] = 5
-            if 49693 not in incomplete_deck and hero == 'mage':
-                scores[49693] = 5
-            if 49702 not in incomplete_deck and hero == 'priest':
-                scores[49702] = 5
-            scores.update({k: v for k, v in self.popularity.items() if k not in scores and k not in incomplete_deck})
-        else:
-            scores = {c: self.popularity[c] + 2 for c in counts[counts == 1].index}
-            scores.update({k: v for k, v in self.popularity.items() if k not in scores})
+        deck_costs = self._cost[self._encode(incomplete_decks)]
+        known = ~np.isnan(deck_costs)
+        min_cost = np.where(known, deck_costs, np.inf).min(axis=1)[:, None]
+        max_cost = np.where(known, deck_costs, -np.inf).max(axis=1)[:, None]
+        all_odd = ~(known & (deck_costs % 2 == 0)).any(axis=1)
+        all_even = ~(known & (deck_costs % 2 == 1)).any(axis=1)
+        cost = self._cost[columns]
+        has_cost = ~np.isnan(cost)
+        odd = has_cost & (cost % 2 == 1)
+        even = has_cost & (cost % 2 == 0)
+        scores = ((cost >= min_cost) & (cost <= max_cost)).astype(np.float64)
+        scores[(all_odd[:, None] & even) | (all_even[:, None] & odd)] = -5.0
+        # if all cards are odd-cost but Baku is not in the deck, only Baku is scored
+        baku = self._column(self.BAKU)
+        only_baku = all_odd & (copies[:, baku] == 0)
+        # if all cards are even-cost but Genn is not in the deck, only Genn is scored
+        genn = self._column(self.GENN)
+        only_genn = ~only_baku & all_even & (copies[:, genn] == 0)
+        scores[only_baku | only_genn] = 0.0
+        for rows, column in ((only_baku, baku), (only_genn, genn)):
+            column = self._candidate_column(columns, column)
+            if column is not None:
+                scores[rows, column] = 10.0
+        return scores
+
+    def _popularity_counter(self) -> PopularityCounter:
+        return PopularityCounter(self.popularity_decay, self.popularity_half_life, self.popularity_window)
+
+    def _popularity_fit(self):
+        key = ArtifactCache.key('EnsembleKnowledge.popularity', self._digest.hexdigest(), self.popularity_decay,
+                                self.popularity_half_life, self.popularity_window)
+        arrays = self._load_artifacts(key, 'popularity')
+        if arrays is not None:
+            self.popularity = dict(zip(arrays['cards'].tolist(), arrays['popularity'].tolist()))
+            return
+        self.popularity = self.popularity_counter.popularity()
+        # all 0 when the kept decks have no weight, e.g. a linear decay over a single day
+        max_popularity = max(self.popularity.values(), default=0.0)
+        if max_popularity > 0:
+            self.popularity = {k: v / max_popularity for k, v in self.popularity.items()}
+        if self.cache is not None:
+            self.cache.save(key, {'cards': np.fromiter(self.popularity.keys(), dtype=np.int64),
+                                  'popularity': np.fromiter(self.popularity.values(), dtype=np.float64)})
+
+    def _popularity_predict(self, incomplete_decks: np.ndarray, copies: np.ndarray, heroes: List[str],
+                            columns: np.ndarray) -> np.ndarray:
+        candidate_copies = copies[:, columns]
+        scores = np.broadcast_to(self._popularity[columns], candidate_copies.shape).copy()
+        no_duplicate = (np.diff(np.sort(incomplete_decks, axis=1), axis=1) != 0).all(axis=1)
+        # cards with a single copy are favored
+        scores[~no_duplicate] += 2.0 * (candidate_copies[~no_duplicate] == 1)
+        # no-duplicate deck, recommend Reno and Kazakus instead of the cards of the deck
+        scores[no_duplicate] *= candidate_copies[no_duplicate] == 0
+        heroes = np.array(heroes, dtype=object)
+        for card, score, hero in self.HIGHLANDER:
+            column = self._column(card)
+            rows = no_duplicate & (copies[:, column] == 0)
+            if hero is not None:
+                rows &= heroes == hero
+            column = self._candidate_column(columns, column)
+            if column is not None:
+                scores[rows, column] = score
         return scores
 
-    def _combo_cluster_fit(self, data: pd.DataFrame):
-        pass
+    def _combo_cluster_fit(self):
+        """
+        cluster the cards that are played together, i.e. connected by a jaccard similarity
+        of their profiles above combo_threshold in the synergy index.
+        """
+        cards = self.synergy_index.cards
+        similarity = sp.csr_matrix(self.synergy_index.similarity)
+        links = sp.triu(similarity.maximum(similarity.T)).tocoo()
+        clusters = find_clusters(cards[links.row], cards[links.col], links.data, self.combo_threshold)
+        self.combo_members = cluster_members(clusters)
+        self.combo_cluster = np.full(cards.shape[0], -1, dtype=np.int64)
+        clustered, labels = clusters
+        self.combo_cluster[self.synergy_index.encode(clustered)] = labels
 
-    def _combo_cluster_predict(self, incomplete_deck: List[int], hero: str, date: str) -> Dict[int, float]:
-        return {}
+    def _combo_cluster_predict(self, incomplete_decks: np.ndarray, copies: np.ndarray,
+                               columns: np.ndarray) -> np.ndarray:
+        """
+        for every cluster the deck partially contains, score its missing members with
+        the share of the cluster that is already in the deck.
+        """
+        in_deck = copies > 0
+        # (batch, n_clusters) number of distinct cards of each cluster in the deck
+        present = np.asarray(self._combo_membership.T @ in_deck.T.astype(np.float64)).T
+        share = present / np.array([m.shape[0] for m in self.combo_members], dtype=np.float64)
+        combo_columns = self._combo_columns[columns]
+        clustered = combo_columns >= 0
+        scores = np.zeros((copies.shape[0], columns.shape[0]), dtype=np.float64)
+        scores[:, clustered] = share[:, combo_columns[clustered]]
+        scores[in_deck[:, columns]] = 0.0
+        return scores
 
-    def predict(self, data: pd.DataFrame) -> List[List[int]]:
+    def _build_card_index(self):
+        """
+        the cards scored at prediction, sorted by id. Every component gives a vector aligned with them.
+        """
+        special = [self.BAKU, self.GENN] + [card for card, _, _ in self.HIGHLANDER]
+        self.cards = np.unique(np.concatenate([self.synergy_index.cards, np.fromiter(self.mana.keys(), dtype=np.int64),
+                                               np.fromiter(self.popularity.keys(), dtype=np.int64),
+                                               np.array(special, dtype=np.int64)]))
+        self._synergy_columns = self._encode(self.synergy_index.cards)
+        # position of every card in the synergy index, -1 for the cards missing from it
+        self._index_columns = np.full(self.cards.shape[0], -1, dtype=np.int64)
+        self._index_columns[self._synergy_columns] = np.arange(self._synergy_columns.shape[0])
+        self._cost = np.full(self.cards.shape[0], np.nan)
+        self._cost[self._encode(list(self.mana.keys()))] = list(self.mana.values())
+        self._popularity = np.zeros(self.cards.shape[0])
+        self._popularity[self._encode(list(self.popularity.keys()))] = list(self.popularity.values())
+        self._combo_columns = np.full(self.cards.shape[0], -1, dtype=np.int64)
+        self._combo_columns[self._synergy_columns] = self.combo_cluster
+        clustered = np.flatnonzero(self._combo_columns >= 0)
+        self._combo_membership = sp.csr_matrix(
+            (np.ones(clustered.shape[0]), (clustered, self._combo_columns[clustered])),
+            shape=(self.cards.shape[0], len(self.combo_members)))
+        self.candidates = HeroCandidates(self.cards)
+
+    def _encode(self, cards) -> np.ndarray:
+        return encode_cards(self.cards, np.arange(self.cards.shape[0]), cards)
+
+    def _column(self, card: int) -> int:
+        return int(self._encode([card])[0])
+
+    @staticmethod
+    def _candidate_column(columns: np.ndarray, column: int) -> Optional[int]:
+        """
+        the position of a column among the candidate columns, None if it is not a candidate
+        """
+        position = np.flatnonzero(columns == column)
+        return int(position[0]) if position.shape[0] else None
+
+    def component_scores(self, data: DeckBatch, columns: Optional[np.ndarray] = None,
+                         similarity=None) -> Dict[str, np.ndarray]:
+        """
+        (batch, n_candidates) score matrix of every component, aligned with self.cards[columns],
+        all the cards if columns is None.
+        similarity: candidate_similarity(columns), computed once for all the batches of the same candidates
+        """
+        profiler = self.profiler
+        all_columns = np.arange(self.cards.shape[0]) if columns is None else columns
+        decks = data.incomplete
+        with profiler.stage('predict.copies'):
+            # number of copies of every card in each deck, the unknown cards left out
+            copies = count_copies(self._encode(decks), self.cards.shape[0])[:, :-1]
+        components = {}
+        with profiler.stage('predict.synergy'):
+            components['synergy'] = self._synergy_predict(decks, copies, columns, similarity)
+        with profiler.stage('predict.mana'):
+            components['mana'] = self._mana_predict(decks, copies, all_columns)
+        with profiler.stage('predict.popularity'):
+            components['popularity'] = self._popularity_predict(decks, copies, data.heroes, all_columns)
+        with profiler.stage('predict.combo'):
+            components['combo'] = self._combo_cluster_predict(decks, copies, all_columns)
+        return components
+
+    def aggregate(self, components: Dict[str, np.ndarray], weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+        weights = self.weights if weights is None else weights
+        aggregated = components['synergy'] * weights['synergy'] \
+            + components['mana'] * weights['mana'] \
+            + components['popularity'] * weights['popularity']
+        aggregated += components['combo'] * weights['combo']
+        return aggregated
+
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
         """
         columns: deckid,update_date,hero,card0..28
         """
-        ret = []
-        for i, row in data.iterrows():
-            incomplete_deck = row[[f'card{j}' for j in range(29)]].to_list()
-            hero = row['hero']
-            date = row['update_date']
-            synergy_scores = pd.Series(self._synergy_predict(incomplete_deck, hero, date), name='synergy')
-            mana_scores = pd.Series(self._mana_predict(incomplete_deck, hero, date), name='mana')
-            popularity_scores = pd.Series(self._popularity_predict(incomplete_deck, hero, date), name='popularity')
-            # combo_scores = pd.Series(self._combo_cluster_predict(incomplete_deck, hero, date), name='combo')
-            scores = synergy_scores.to_frame()\
-                .join(mana_scores, how='outer')\
-                .join(popularity_scores, how='outer')#\
-                #.join(combo_scores, how='outer')
-            scores.fillna(0, inplace=True)
-            scores['aggregated'] = scores['synergy'] * self.weights['synergy'] \
-                                   + scores['mana'] * self.weights['mana'] \
-                                   + scores['popularity'] * self.weights['popularity']# \
-                                   #+ scores['combo'] * self.weights['combo']
-            scores.sort_values(by='aggregated', ascending=False, inplace=True)
-            recommendation = []
-            for card in scores.index:
-                if check_validity(incomplete_deck, card, hero):
-                    recommendation.append(card)
-                    if len(recommendation) == 3:
-                        break
-            ret.append(recommendation)
-            if i % 10 == 9:
-                print(f"Prediction progress {i + 1} / {data.shape[0]}")
-        return ret
+        data = DeckBatch.coerce(data)
+        self.finalize()
+        self.profiler.count('decks_predicted', len(data))
+        return self._predict_by_hero(data, self.cards, self.candidates, self.batch_size, self._score)
+
+    def _score(self, batch: DeckBatch) -> np.ndarray:
+        components = self.component_scores(batch)
+        with self.profiler.stage('predict.aggregate'):
+            return self.aggregate(components)
@@ -0,0 +1,102 @@
+from typing import Dict, Optional, Sequence
+import numpy as np
+import scipy.sparse as sp
+from .utility import encode_cards
+
+
+class CardIncidence:
+    """
+    Sparse card x deck incidence matrix.
+    Row i is the profile of card cards[i]: the set of decks that include it.
+    Profile sizes are kept so that jaccard(a, b) = |a&b| / (|a| + |b| - |a&b|)
+    only needs the intersection counts, which come from one sparse matrix product.
+    """
+    def __init__(self, cards: np.ndarray, matrix: sp.csr_matrix):
+        self.cards = np.asarray(cards, dtype=np.int64)
+        self.index: Dict[int, int] = {int(c): i for i, c in enumerate(self.cards)}
+        self._sorter = np.argsort(self.cards, kind='stable')
+        self.matrix = matrix.tocsr()
+        self.sizes = np.asarray(self.matrix.sum(axis=1), dtype=np.float64).ravel()
+
+    @classmethod
+    def from_decks(cls, decks: np.ndarray, columns: Optional[np.ndarray] = None) -> 'CardIncidence':
+        """
+        decks: (n_decks, n_cards) array of card ids, one deck per row.
+        columns: (n_decks,) the column of every deck, decks sharing a column are merged. One column per deck by default.
+        Cards are indexed in order of first appearance (row by row).
+        """
+        decks = np.asarray(decks, dtype=np.int64)
+        columns = np.arange(decks.shape[0]) if columns is None else np.asarray(columns, dtype=np.int64)
+        cards, first, codes = np.unique(decks.ravel(), return_index=True, return_inverse=True)
+        # np.unique sorts, re-rank by first appearance to keep the dict insertion order of the set-based code
+        order = np.argsort(first, kind='stable')
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.shape[0])
+        rows = rank[codes.ravel()]
+        cols = np.repeat(columns, decks.shape[1])
+        n_columns = int(columns.max()) + 1 if columns.shape[0] else 0
+        matrix = sp.csr_matrix((np.ones(rows.shape[0], dtype=np.float64), (rows, cols)),
+                               shape=(cards.shape[0], n_columns))
+        # duplicated cards in a deck are summed by the constructor, a profile is a set
+        matrix.data[:] = 1.0
+        return cls(cards[order], matrix)
+
+    def extend(self, decks: np.ndarray, columns: Optional[np.ndarray] = None) -> 'CardIncidence':
+        """
+        the incidence with the decks added, new cards appended in order of first appearance:
+        the same as from_decks on all the decks at once.
+        columns: as for from_decks, new columns after the existing ones by default.
+        """
+        n_decks = self.matrix.shape[1]
+        if columns is None:
+            columns = np.arange(n_decks, n_decks + len(decks))
+        chunk = CardIncidence.from_decks(decks, columns)
+        cards = np.concatenate([self.cards, chunk.cards[self.encode(chunk.cards) < 0]])
+        rows = encode_cards(cards, np.argsort(cards, kind='stable'), chunk.cards)
+        old, new = self.matrix.tocoo(), chunk.matrix.tocoo()
+        matrix = sp.csr_matrix((np.concatenate([old.data, new.data]),
+                                (np.concatenate([old.row, rows[new.row]]), np.concatenate([old.col, new.col]))),
+                               shape=(cards.shape[0], max(n_decks, chunk.matrix.shape[1])))
+        matrix.data[:] = 1.0
+        return CardIncidence(cards, matrix)
+
+    def encode(self, decks: Sequence[Sequence[int]]) -> np.ndarray:
+        """
+        map card ids to row indices, -1 for cards without a profile.
+        """
+        return encode_cards(self.cards, self._sorter, decks)
+
+    def jaccard_rows(self, rows: np.ndarray) -> np.ndarray:
+        """
+        (len(rows), n_vocab) jaccard similarity between the profiles of cards[rows] and every card.
+        A card is not compared with itself, so its own entry is 0.
+        """
+        intersection = (self.matrix[rows] @ self.matrix.T).toarray()
+        union = self.sizes[rows][:, None] + self.sizes[None, :] - intersection
+        similarity = intersection / union
+        similarity[np.arange(rows.shape[0]), rows] = 0.0
+        return similarity
+
+
+def deck_indicator(codes: np.ndarray, n_vocab: int) -> sp.csr_matrix:
+    """
+    (batch, n_vocab) 0/1 matrix of the distinct known cards of each deck, codes being -1 for unknown cards.
+    """
+    deck_rows, deck_cols = np.nonzero(codes >= 0)
+    query = sp.csr_matrix((np.ones(deck_rows.shape[0]), (deck_rows, codes[deck_rows, deck_cols])),
+                          shape=(codes.shape[0], n_vocab))
+    query.data[:] = 1.0
+    return query
+
+
+def average_over_deck(query: sp.csr_matrix, total, columns: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    turn the summed similarity to the deck cards into an average.
+    A card of the deck is averaged over the other cards only.
+    columns: the cards of the columns of total, all the cards if None
+    """
+    total = total.toarray() if sp.issparse(total) else np.asarray(total)
+    in_deck = query.toarray() if columns is None else query[:, columns].toarray()
+    count = np.asarray(query.sum(axis=1)).ravel()[:, None] - in_deck
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, total / count, 0.0)
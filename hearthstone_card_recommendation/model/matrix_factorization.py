@@ -0,0 +1,129 @@
+import os
+from typing import List, Optional, Union
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.sparse.linalg import svds
+from .abstract_model import RecommendModel
+from .candidates import HeroCandidates
+from .decks import DeckBatch
+from .incidence import CardIncidence
+from .utility import encode_cards
+
+
+class MatrixFactorization(RecommendModel):
+    """
+    Latent factors of the card x deck incidence: truncated SVD X ~ U S V^T, the embedding of a card being
+    its row of U sqrt(S). A deck is the mean embedding of its known cards, and a card is scored by the dot product
+    of its embedding with the deck's, so that predicting costs the same whatever the number of training decks.
+    The embeddings are saved to embeddings_dir and memory-mapped from there.
+    """
+    fit_only_attributes = ('cards_profile',)
+
+    def __init__(self, factors: int = 64, batch_size: int = 256,
+                 embeddings_dir: Optional[str] = "data/card_embeddings"):
+        """
+        factors: dimension of the embeddings
+        embeddings_dir: where cards.npy and embeddings.npy are written after fitting, None to keep them in memory
+        """
+        self.factors = factors
+        self.batch_size = batch_size
+        self.embeddings_dir = embeddings_dir
+        self.cards_profile: Optional[CardIncidence] = None
+        self.cards = np.zeros(0, dtype=np.int64)
+        self._sorter = np.zeros(0, dtype=np.int64)
+        # (n_cards, factors) embedding of every card of self.cards
+        self.embeddings = np.zeros((0, factors))
+        # candidate columns of self.cards for every hero
+        self.candidates: Optional[HeroCandidates] = None
+        self._pending = False
+
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        columns: deckid,update_date,hero,card0..28, target
+        """
+        self.cards_profile = None
+        self.partial_fit(data)
+        self.finalize()
+
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        columns: deckid,update_date,hero,card0..28, target
+        the embeddings are computed by finalize.
+        """
+        data = DeckBatch.coerce(data)
+        with self.profiler.stage('partial_fit'):
+            if self.cards_profile is None:
+                self.cards_profile = CardIncidence.from_decks(data.cards)
+            else:
+                self.cards_profile = self.cards_profile.extend(data.cards)
+        self.profiler.count('decks_fitted', len(data))
+        self._pending = True
+
+    def finalize(self):
+        if not self._pending:
+            return
+        with self.profiler.stage('finalize.svd'):
+            incidence = self.cards_profile.matrix
+            # svds needs fewer factors than the smallest dimension, a fixed starting vector for reproducibility
+            factors = min(self.factors, min(incidence.shape) - 1)
+            v0 = np.full(min(incidence.shape), 1 / np.sqrt(min(incidence.shape)))
+            u, s, _ = svds(incidence, k=factors, v0=v0)
+            embeddings = u * np.sqrt(s)
+        self._pending = False
+        self.cards = self.cards_profile.cards
+        if self.embeddings_dir is not None:
+            with self.profiler.stage('finalize.save'):
+                self.save(self.embeddings_dir, embeddings)
+                self.load_embeddings(self.embeddings_dir)
+        else:
+            self._set_embeddings(self.cards, embeddings)
+
+    def _set_embeddings(self, cards: np.ndarray, embeddings: np.ndarray):
+        self.cards = cards
+        self._sorter = np.argsort(cards, kind='stable')
+        self.embeddings = embeddings
+        self.candidates = HeroCandidates(cards)
+
+    def save(self, directory: str, embeddings: Optional[np.ndarray] = None):
+        """
+        each file is written aside and renamed, so that the embeddings memory-mapped by another model stay valid
+        """
+        os.makedirs(directory, exist_ok=True)
+        arrays = {'cards': self.cards, 'embeddings': self.embeddings if embeddings is None else embeddings}
+        for name, array in arrays.items():
+            path = os.path.join(directory, f"{name}.npy")
+            tmp = f"{path}.tmp{os.getpid()}.npy"
+            np.save(tmp, np.asarray(array))
+            os.replace(tmp, path)
+
+    def load_embeddings(self, directory: str):
+        """
+        memory-map the embeddings saved by fit, predict does not need anything else.
+        """
+        self._set_embeddings(np.load(os.path.join(directory, "cards.npy")),
+                             np.load(os.path.join(directory, "embeddings.npy"), mmap_mode='r'))
+
+    def deck_embeddings(self, decks: np.ndarray) -> np.ndarray:
+        """
+        (batch, factors) mean embedding of the known cards of every deck, each copy counted
+        """
+        codes = encode_cards(self.cards, self._sorter, decks)
+        deck_rows, deck_cols = np.nonzero(codes >= 0)
+        copies = sp.csr_matrix((np.ones(deck_rows.shape[0]), (deck_rows, codes[deck_rows, deck_cols])),
+                               shape=(codes.shape[0], self.cards.shape[0]))
+        n_known = np.maximum(np.bincount(deck_rows, minlength=codes.shape[0]), 1)[:, None]
+        return np.asarray(copies @ self.embeddings) / n_known
+
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
+        """
+        columns: deckid,update_date,hero,card0..28
+        """
+        data = DeckBatch.coerce(data)
+        self.finalize()
+        self.profiler.count('decks_predicted', len(data))
+        return self._predict_by_hero(data, self.cards, self.candidates, self.batch_size, self._score)
+
+    def _score(self, batch: DeckBatch) -> np.ndarray:
+        with self.profiler.stage('predict.score'):
+            return self.deck_embeddings(batch.incomplete) @ self.embeddings.T
@@ -0,0 +1,41 @@
+from typing import Sequence, Union
+import numpy as np
+from .decks import NO_CARD
+
+Predictions = Union[np.ndarray, Sequence[Sequence[int]]]
+
+
+def prediction_array(pred: Predictions, k: int = 3) -> np.ndarray:
+    """
+    (n_decks, k) recommended cards, best first, padded with NO_CARD
+    """
+    if isinstance(pred, np.ndarray):
+        return pred[:, :k]
+    ret = np.full((len(pred), k), NO_CARD, dtype=np.int64)
+    for i, row in enumerate(pred):
+        row = row[:k]
+        ret[i, :len(row)] = row
+    return ret
+
+
+def hits(pred: Predictions, target: np.ndarray, k: int = 3) -> np.ndarray:
+    """
+    (n_decks,) whether the target is among the first k recommendations
+    """
+    return (prediction_array(pred, k) == np.asarray(target)[:, None]).any(axis=1)
+
+
+def reciprocal_ranks(pred: Predictions, target: np.ndarray, k: int = 3) -> np.ndarray:
+    """
+    (n_decks,) 1 / rank of the target in the first k recommendations, 0 if it is not among them
+    """
+    match = prediction_array(pred, k) == np.asarray(target)[:, None]
+    return np.where(match.any(axis=1), 1.0 / (match.argmax(axis=1) + 1), 0.0)
+
+
+def hit_at_k(pred: Predictions, target: np.ndarray, k: int = 3) -> float:
+    return float(hits(pred, target, k).mean()) if len(pred) else 0.0
+
+
+def mean_reciprocal_rank(pred: Predictions, target: np.ndarray, k: int = 3) -> float:
+    return float(reciprocal_ranks(pred, target, k).mean()) if len(pred) else 0.0
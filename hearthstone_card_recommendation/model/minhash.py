@@ -0,0 +1,131 @@
+from typing import Optional, Tuple
+import numpy as np
+import scipy.sparse as sp
+from .incidence import deck_indicator
+from .utility import encode_cards
+
+# modulus of the universal hash functions (a * card + b) % PRIME, card ids are below it
+PRIME = (1 << 31) - 1
+
+
+class MinHashIndex:
+    """
+    Approximate deck-to-deck nearest neighbours by jaccard similarity of the card sets.
+    Every deck gets a MinHash signature of bands * rows hash values, and is put in one bucket per band keyed
+    by its rows values: two decks of similarity s share a bucket with probability 1 - (1 - s^rows)^bands.
+    A query deck is compared exactly with the decks of its buckets only, at most bucket_size per bucket.
+    More bands or fewer rows find more neighbours (recall) for more comparisons (time).
+    """
+    def __init__(self, cards: np.ndarray, decks: sp.csr_matrix, bands: int, rows: int, bucket_size: int,
+                 hash_a: np.ndarray, hash_b: np.ndarray, band_multipliers: np.ndarray,
+                 band_keys: np.ndarray, band_decks: np.ndarray):
+        self.cards = cards
+        self._sorter = np.arange(cards.shape[0])
+        # (n_decks, n_vocab) 0/1 distinct cards of every training deck
+        self.decks = decks
+        self.sizes = np.asarray(decks.sum(axis=1)).ravel()
+        self.bands = bands
+        self.rows = rows
+        self.bucket_size = bucket_size
+        self.hash_a = hash_a
+        self.hash_b = hash_b
+        self.band_multipliers = band_multipliers
+        # (bands, n_decks) bucket keys of every band sorted, and the decks in that order
+        self.band_keys = band_keys
+        self.band_decks = band_decks
+
+    @classmethod
+    def build(cls, decks: np.ndarray, bands: int = 32, rows: int = 4, bucket_size: int = 256,
+              seed: int = 0, block_size: int = 1024) -> 'MinHashIndex':
+        """
+        decks: (n_decks, n_cards) card ids of the training decks
+        """
+        decks = np.asarray(decks, dtype=np.int64)
+        rng = np.random.default_rng(seed)
+        n_hashes = bands * rows
+        hash_a = rng.integers(1, PRIME, n_hashes, dtype=np.int64)
+        hash_b = rng.integers(0, PRIME, n_hashes, dtype=np.int64)
+        band_multipliers = rng.integers(1, np.iinfo(np.int64).max, rows, dtype=np.int64).astype(np.uint64)
+        band_multipliers |= np.uint64(1)
+        cards = np.unique(decks)
+        index = cls(cards, deck_indicator(encode_cards(cards, np.arange(cards.shape[0]), decks), cards.shape[0]),
+                    bands, rows, bucket_size, hash_a, hash_b, band_multipliers,
+                    np.zeros((bands, 0), dtype=np.uint64), np.zeros((bands, 0), dtype=np.int64))
+        keys = np.hstack([index._band_keys(decks[start:start + block_size]).T
+                          for start in range(0, decks.shape[0], block_size)]) \
+            if decks.shape[0] else np.zeros((bands, 0), dtype=np.uint64)
+        index.band_decks = np.argsort(keys, axis=1, kind='stable')
+        index.band_keys = np.take_along_axis(keys, index.band_decks, axis=1)
+        return index
+
+    def signatures(self, decks: np.ndarray) -> np.ndarray:
+        """
+        (n_decks, bands * rows) minimum of every hash function over the cards of each deck
+        """
+        # hashed once per distinct card, the hashes being below PRIME they fit in int32
+        cards, codes = np.unique(np.asarray(decks, dtype=np.int64), return_inverse=True)
+        hashes = ((cards[:, None] * self.hash_a + self.hash_b) % PRIME).astype(np.int32)
+        return hashes[codes.reshape(np.shape(decks))].min(axis=1)
+
+    def _band_keys(self, decks: np.ndarray) -> np.ndarray:
+        """
+        (n_decks, bands) bucket key of every band, the rows values of a band mixed with wrapping multiplications
+        """
+        signatures = self.signatures(decks).astype(np.uint64).reshape(-1, self.bands, self.rows)
+        return (signatures * self.band_multipliers).sum(axis=2, dtype=np.uint64)
+
+    def encode(self, decks: np.ndarray) -> np.ndarray:
+        return encode_cards(self.cards, self._sorter, decks)
+
+    def _candidates(self, decks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (query row, training deck) distinct pairs sharing a bucket
+        """
+        n_decks = self.band_keys.shape[1]
+        keys = self._band_keys(decks)
+        bands = np.arange(self.bands)
+        lo = np.stack([np.searchsorted(self.band_keys[b], keys[:, b], side='left') for b in bands], axis=1)
+        hi = np.stack([np.searchsorted(self.band_keys[b], keys[:, b], side='right') for b in bands], axis=1)
+        counts = (np.minimum(hi, lo + self.bucket_size) - lo).ravel()
+        # every (query, band) range of the sorted keys enumerated at once
+        starts = np.repeat(lo.ravel() + np.tile(bands, decks.shape[0]) * n_decks, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        queries = np.repeat(np.arange(decks.shape[0]), counts.reshape(-1, self.bands).sum(axis=1))
+        pairs = np.unique(queries * n_decks + self.band_decks.ravel()[starts + offsets])
+        return pairs // n_decks, pairs % n_decks
+
+    def neighbours(self, decks: np.ndarray, k: int, exact: bool = False) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (query row, training deck, jaccard similarity) of the k most similar training decks of every query deck,
+        among the decks sharing a bucket with it, or among all of them if exact.
+        Fewer than k are returned when fewer candidates are similar at all.
+        """
+        decks = np.asarray(decks, dtype=np.int64)
+        query = deck_indicator(self.encode(decks), self.cards.shape[0])
+        if exact:
+            intersection = (query @ self.decks.T).tocoo()
+            queries, neighbours, intersection = intersection.row, intersection.col, intersection.data
+        else:
+            queries, neighbours = self._candidates(decks)
+            intersection = np.asarray(query[queries].multiply(self.decks[neighbours]).sum(axis=1)).ravel()
+        # the cards unknown to the index count in the size of the query deck
+        sorted_decks = np.sort(decks, axis=1)
+        query_sizes = 1.0 + (sorted_decks[:, 1:] != sorted_decks[:, :-1]).sum(axis=1)
+        similarity = intersection / (query_sizes[queries] + self.sizes[neighbours] - intersection)
+        order = np.lexsort((neighbours, -similarity, queries))
+        queries, neighbours, similarity = queries[order], neighbours[order], similarity[order]
+        first = np.searchsorted(queries, queries, side='left')
+        keep = (np.arange(queries.shape[0]) - first < k) & (similarity > 0)
+        return queries[keep], neighbours[keep], similarity[keep]
+
+    def neighbour_scores(self, decks: np.ndarray, k: int, columns: Optional[np.ndarray] = None,
+                         exact: bool = False) -> np.ndarray:
+        """
+        (batch, n_vocab) for every card, the summed similarity of the neighbours playing it.
+        columns: only the cards of these columns are returned, selected from the product with the neighbour decks
+        so that the cost does not grow with the number of training decks
+        """
+        queries, neighbours, similarity = self.neighbours(decks, k, exact)
+        weights = sp.csr_matrix((similarity, (queries, neighbours)), shape=(len(decks), self.decks.shape[0]))
+        scores = weights @ self.decks
+        return (scores if columns is None else scores[:, columns]).toarray()
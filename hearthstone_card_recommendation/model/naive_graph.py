@@ -1,14 +1,46 @@
 from .abstract_model import RecommendModel
+from .candidates import HeroCandidates
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple, Optional
-from .utility import check_validity
+import scipy.sparse as sp
+from typing import List, Dict, Tuple, Optional, Union
+from .decks import DeckBatch
+from .topk import top_k_cards
+from .utility import valid_mask, encode_cards
 import json
 
+MAX_DENSE_CARDS = 4096
+
 
 class NaiveGraph(RecommendModel):
-    def __init__(self):
+    """
+    Co-occurrence graph between the cards of a deck and its target.
+    backend 'matrix' keeps the weights in a symmetric (n_vocab, n_vocab) matrix, dense up to MAX_DENSE_CARDS cards
+    and sparse beyond, 'dict' in a dict keyed by card pairs.
+    The graph is exported to export_path after fitting: edge arrays for .npz, the former dict format for .json.
+    """
+    fit_only_attributes = ('_seen', '_counts')
+
+    def __init__(self, backend: str = 'matrix', export_path: Optional[str] = "data/naive_graph.npz",
+                 batch_size: int = 256):
+        if backend not in ('matrix', 'dict'):
+            raise ValueError(f"Unknown NaiveGraph backend {backend}")
+        self.backend = backend
+        self.export_path = export_path
+        self.batch_size = batch_size
         self.graph: Dict[Tuple[int, int], float] = {}
         self.vocabulary = set()
+        # matrix backend
+        self.cards = np.zeros(0, dtype=np.int64)
+        self._sorter = np.zeros(0, dtype=np.int64)
+        self.weights: Union[np.ndarray, sp.csr_matrix, None] = None
+        # candidate columns of self.cards for every hero
+        self.candidates: Optional[HeroCandidates] = None
+        # weights accumulated by partial_fit over the cards in order of first appearance (_seen),
+        # turned into self.weights by finalize
+        self._seen = np.zeros(0, dtype=np.int64)
+        self._counts = sp.csr_matrix((0, 0))
+        self._pending = False
 
     def _update_graph(self, c1: int, c2: int, weight: float):
         self.vocabulary.add(c1)
@@ -31,31 +63,112 @@ class NaiveGraph(RecommendModel):
             return self.graph[key]
         return 0.0
 
-    def fit(self, data: pd.DataFrame):
-        for _, row in data.iterrows():
-            for i in range(29):
-                self._update_graph(row[f'card{i}'], row['target'], 1.0)
-        with open("data/naive_graph.json", "w") as fp:
-            graph = {str(key): v for key, v in self.graph.items()}
-            json.dump(graph, fp)
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        self.graph = {}
+        self.vocabulary = set()
+        self._seen = np.zeros(0, dtype=np.int64)
+        self._counts = sp.csr_matrix((0, 0))
+        self.partial_fit(data)
+        self.finalize()
+
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        the graph is finalized, and exported, by finalize
+        """
+        data = DeckBatch.coerce(data)
+        with self.profiler.stage('partial_fit'):
+            if self.backend == 'dict':
+                for deck in data.cards.tolist():
+                    for card in deck[:29]:
+                        self._update_graph(card, deck[29], 1.0)
+            else:
+                self._accumulate_matrix(data)
+        self.profiler.count('decks_fitted', len(data))
+        self._pending = True
+
+    def _accumulate_matrix(self, data: DeckBatch):
+        incomplete = data.incomplete.astype(np.int64)
+        target = np.repeat(data.target.astype(np.int64)[:, None], 29, axis=1)
+        pairs = np.stack([incomplete, target], axis=2).ravel()
+        # the set is filled in the same order as the dict backend, so the candidates come in the same order
+        self.vocabulary.update(pairs.tolist())
+        cards, first = np.unique(pairs, return_index=True)
+        new = cards[np.argsort(first, kind='stable')]
+        self._seen = np.concatenate([self._seen, new[encode_cards(self._seen, np.argsort(self._seen), new) < 0]])
+        n_seen = self._seen.shape[0]
+        sorter = np.argsort(self._seen, kind='stable')
+        rows = encode_cards(self._seen, sorter, incomplete).ravel()
+        cols = encode_cards(self._seen, sorter, target).ravel()
+        # one weight per (card, target) pair in both directions, a card paired with itself only once
+        off_diagonal = rows != cols
+        rows, cols = np.concatenate([rows, cols[off_diagonal]]), np.concatenate([cols, rows[off_diagonal]])
+        counts = sp.csr_matrix((np.ones(rows.shape[0], dtype=np.float64), (rows, cols)), shape=(n_seen, n_seen))
+        self._counts.resize((n_seen, n_seen))
+        self._counts = self._counts + counts
 
-    def predict(self, data: pd.DataFrame) -> List[List[int]]:
+    def finalize(self):
+        if not self._pending:
+            return
+        if self.backend == 'matrix':
+            with self.profiler.stage('finalize.weights'):
+                self.cards = np.array(list(self.vocabulary), dtype=np.int64)
+                self._sorter = np.argsort(self.cards, kind='stable')
+                order = encode_cards(self._seen, np.argsort(self._seen, kind='stable'), self.cards)
+                weights = self._counts[order][:, order]
+                self.weights = weights.toarray() if self.cards.shape[0] <= MAX_DENSE_CARDS else weights
+                self.candidates = HeroCandidates(self.cards)
+        self._pending = False
+        if self.export_path is not None:
+            with self.profiler.stage('finalize.export'):
+                self.export(self.export_path)
+
+    def edges(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (c1, c2, weight) arrays of all the edges with c1 <= c2
+        """
+        if self.backend == 'dict':
+            pairs = np.array(list(self.graph.keys()), dtype=np.int64).reshape(-1, 2)
+            return pairs[:, 0], pairs[:, 1], np.fromiter(self.graph.values(), dtype=np.float64, count=len(self.graph))
+        upper = sp.triu(sp.csr_matrix(self.weights)).tocoo()
+        c1, c2 = self.cards[upper.row], self.cards[upper.col]
+        return np.minimum(c1, c2), np.maximum(c1, c2), upper.data
+
+    def export(self, path: str):
+        c1, c2, weight = self.edges()
+        if path.endswith('.json'):
+            with open(path, "w") as fp:
+                json.dump({str((a, b)): w for a, b, w in zip(c1.tolist(), c2.tolist(), weight.tolist())}, fp)
+        else:
+            np.savez(path, c1=c1, c2=c2, weight=weight)
+
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
+        data = DeckBatch.coerce(data)
+        self.finalize()
+        self.profiler.count('decks_predicted', len(data))
+        if self.backend == 'matrix':
+            return self._predict_by_hero(data, self.cards, self.candidates, self.batch_size, self._matrix_score)
         pred = []
-        for _, row in data.iterrows():
-            pred.append(self._predict_one([row[f'card{i}'] for i in range(29)], row['hero']))
+        with self.profiler.stage('predict.dict'):
+            for deck, hero in zip(data.incomplete.tolist(), data.heroes):
+                pred.append(self._predict_one(deck, hero))
+        self.profiler.count('candidates_scored', len(data) * len(self.vocabulary))
         return pred
 
+    def _matrix_score(self, batch: DeckBatch) -> np.ndarray:
+        """
+        the score of a candidate is the sum of its weights with the 29 cards, the rows of the deck cards summed.
+        """
+        with self.profiler.stage('predict.score'):
+            codes = encode_cards(self.cards, self._sorter, batch.incomplete)
+            deck_rows, deck_cols = np.nonzero(codes >= 0)
+            # (batch, n_vocab) number of copies of every card in the deck
+            counts = sp.csr_matrix((np.ones(deck_rows.shape[0]), (deck_rows, codes[deck_rows, deck_cols])),
+                                   shape=(len(batch), self.cards.shape[0]))
+            rankings = counts @ self.weights
+            return rankings.toarray() if sp.issparse(rankings) else np.asarray(rankings)
+
     def _predict_one(self, incomplete_deck: List[int], hero: Optional[str] = None) -> List[int]:
-        rankings = {}
-        for candidate in list(self.vocabulary):
-            rankings[candidate] = 0
-            for card in incomplete_deck:
-                rankings[candidate] += self._get_weight(card, candidate)
-        rankings = sorted([(k, v) for k, v in rankings.items()], key=lambda r: r[1], reverse=True)
-        valid_rankings = []
-        for r in rankings:
-            if check_validity(incomplete_deck, r[0], hero):
-                valid_rankings.append(r[0])
-                if len(valid_rankings) == 3:
-                    break
-        return valid_rankings
+        candidates = list(self.vocabulary)
+        rankings = [sum(self._get_weight(card, candidate) for card in incomplete_deck) for candidate in candidates]
+        return top_k_cards(candidates, np.array([rankings], dtype=np.float64),
+                           valid_mask(incomplete_deck, candidates, hero)[None, :])[0]
@@ -0,0 +1,92 @@
+import io
+import pickle
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from typing import List, Optional, Tuple
+import numpy as np
+from .abstract_model import RecommendModel
+from .decks import DeckBatch
+from . import utility
+
+# arrays smaller than this are pickled with the model
+MIN_SHARED_BYTES = 1 << 16
+
+# worker state: the model and the shared memory blocks backing its arrays
+_MODEL: Optional[RecommendModel] = None
+_ATTACHED: List[SharedMemory] = []
+
+
+def _attach(name: str, shape: Tuple[int, ...], dtype: str) -> np.ndarray:
+    # the pool workers share the resource tracker of the parent, which unlinks the block
+    block = SharedMemory(name=name)
+    _ATTACHED.append(block)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+class _SharingPickler(pickle.Pickler):
+    """
+    Pickles the large numpy arrays of the model as handles to shared memory blocks holding a copy of them.
+    """
+    def __init__(self, file):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.blocks: List[SharedMemory] = []
+
+    def reducer_override(self, obj):
+        if type(obj) in (np.ndarray, np.memmap) and obj.dtype != object and obj.nbytes >= MIN_SHARED_BYTES:
+            block = SharedMemory(create=True, size=obj.nbytes)
+            self.blocks.append(block)
+            np.ndarray(obj.shape, dtype=obj.dtype, buffer=block.buf)[...] = obj
+            return _attach, (block.name, obj.shape, obj.dtype.str)
+        return NotImplemented
+
+
+def share_model(model: RecommendModel) -> Tuple[bytes, List[SharedMemory]]:
+    """
+    the model pickled without its fit-only attributes and with its arrays in shared memory.
+    The blocks have to be closed and unlinked by the caller once the workers are done.
+    """
+    buffer = io.BytesIO()
+    pickler = _SharingPickler(buffer)
+    try:
+        pickler.dump(model.fitted_copy())
+    except Exception:
+        _release(pickler.blocks)
+        raise
+    return buffer.getvalue(), pickler.blocks
+
+
+def _release(blocks: List[SharedMemory]):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _init_worker(blob: bytes, reference_path: str):
+    global _MODEL
+    utility.set_reference_path(reference_path)
+    _MODEL = pickle.loads(blob)
+
+
+def _predict_shard(shard: DeckBatch) -> List[List[int]]:
+    return _MODEL.predict(shard)
+
+
+def parallel_predict(model: RecommendModel, data: DeckBatch, workers: int) -> List[List[int]]:
+    """
+    model.predict over a process pool: the decks are split in one contiguous shard per worker
+    and the predictions are returned in the original order.
+    """
+    data = DeckBatch.coerce(data)
+    if workers <= 1 or len(data) == 0:
+        return model.predict(data)
+    blob, blocks = share_model(model)
+    try:
+        bounds = np.linspace(0, len(data), workers + 1).astype(int)
+        shards = [data[start:end] for start, end in zip(bounds[:-1], bounds[1:]) if end > start]
+        with get_context().Pool(workers, initializer=_init_worker, initargs=(blob, utility.REFERENCE_PATH)) as pool:
+            predictions = pool.map(_predict_shard, shards)
+    finally:
+        _release(blocks)
+    return [recommendation for shard in predictions for recommendation in shard]
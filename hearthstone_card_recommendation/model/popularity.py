@@ -0,0 +1,139 @@
+from typing import Callable, Dict, Optional, Union
+import numpy as np
+
+# weights of the decks of `days`, given the first and last days of the counted decks
+Decay = Callable[[np.ndarray, int, int], np.ndarray]
+
+
+def linear_decay(days: np.ndarray, first: int, last: int) -> np.ndarray:
+    """
+    (d - first) / (last - first), decks all from the same day weigh 0
+    """
+    return (days - first) / max(last - first, 1)
+
+
+def exponential_decay(half_life: float) -> Decay:
+    """
+    a deck weighs half as much every half_life days before the last day
+    """
+    def decay(days: np.ndarray, first: int, last: int) -> np.ndarray:
+        return np.exp2((days - last) / half_life)
+    return decay
+
+
+class PopularityCounter:
+    """
+    Recency-weighted number of decks playing each card, a deck of day d weighing decay(d, first, last),
+    linear by default: (d - first) / (last - first).
+    The number of decks playing each card is kept per day, so that decks can be added in any number of chunks,
+    the days older than the window expired, and the decay changed without counting the decks again.
+    decay: 'linear', 'exponential' (with half_life in days) or a function of (days, first, last)
+    window: number of days kept before the last day, None to keep every day
+    """
+    def __init__(self, decay: Union[str, Decay] = 'linear', half_life: float = 30.0, window: Optional[int] = None):
+        self.decay = decay
+        self.half_life = half_life
+        self.window = window
+        # card ids, in the order the cards were first seen
+        self.cards = np.zeros(0, dtype=np.int64)
+        self._sorter = np.zeros(0, dtype=np.int64)
+        # (n_days, n_cards) number of decks of every day playing every card
+        self.days = np.zeros(0, dtype=np.int64)
+        self.counts = np.zeros((0, 0), dtype=np.int64)
+
+    @property
+    def first_day(self) -> Optional[int]:
+        return int(self.days[0]) if self.days.size else None
+
+    @property
+    def last_day(self) -> Optional[int]:
+        return int(self.days[-1]) if self.days.size else None
+
+    def _add_cards(self, decks: np.ndarray, new: np.ndarray):
+        # in order of first appearance, within a deck in the order of iteration of set(deck) as
+        # SimplePopularity used to, so that the cards of equal popularity keep their order
+        rows = np.unique(np.nonzero(np.isin(decks, new))[0])
+        pending = set(new.tolist())
+        ordered = []
+        for deck in decks[rows].tolist():
+            for card in set(deck):
+                if card in pending:
+                    ordered.append(card)
+                    pending.remove(card)
+            if not pending:
+                break
+        self.cards = np.concatenate([self.cards, np.array(ordered, dtype=np.int64)])
+        self._sorter = np.argsort(self.cards, kind='stable')
+        self.counts = np.pad(self.counts, ((0, 0), (0, len(ordered))))
+
+    def _columns(self, decks: np.ndarray, cards: np.ndarray) -> np.ndarray:
+        """
+        columns of cards in self.counts, the cards of decks not seen yet are added
+        """
+        known = self.cards[self._sorter]
+        positions = np.minimum(np.searchsorted(known, cards), max(known.size - 1, 0))
+        missing = known[positions] != cards if known.size else np.ones(cards.shape, dtype=bool)
+        if missing.any():
+            self._add_cards(decks, np.unique(cards[missing]))
+            return self._columns(decks, cards)
+        return self._sorter[positions]
+
+    def update(self, decks: np.ndarray, days: np.ndarray):
+        """
+        decks: (n_decks, n_cards) card ids, days: (n_decks,) days of the decks
+        """
+        if days.shape[0] == 0:
+            return
+        decks = np.asarray(decks, dtype=np.int64)
+        days = np.asarray(days, dtype=np.int64)
+        # every card once per deck
+        cards = np.sort(decks, axis=1)
+        distinct = np.ones(cards.shape, dtype=bool)
+        distinct[:, 1:] = cards[:, 1:] != cards[:, :-1]
+        deck_rows = np.nonzero(distinct)[0]
+        columns = self._columns(decks, cards[distinct])
+        all_days = np.union1d(self.days, days)
+        if all_days.size != self.days.size:
+            counts = np.zeros((all_days.size, self.cards.size), dtype=np.int64)
+            counts[np.searchsorted(all_days, self.days)] = self.counts
+            self.days, self.counts = all_days, counts
+        cells = np.searchsorted(self.days, days)[deck_rows] * self.cards.size + columns
+        self.counts += np.bincount(cells, minlength=self.counts.size).reshape(self.counts.shape)
+        if self.window is not None:
+            self.expire(self.last_day - self.window)
+
+    def expire(self, before: int):
+        """
+        forget the decks of the days before `before`
+        """
+        keep = self.days >= before
+        self.days = self.days[keep]
+        self.counts = self.counts[keep]
+
+    def weights(self) -> np.ndarray:
+        """
+        (n_days,) weight of a deck of every day
+        """
+        if self.decay == 'linear':
+            return linear_decay(self.days, self.first_day, self.last_day)
+        if self.decay == 'exponential':
+            return exponential_decay(self.half_life)(self.days, self.first_day, self.last_day)
+        return self.decay(self.days, self.first_day, self.last_day)
+
+    def scores(self) -> np.ndarray:
+        """
+        (n_cards,) popularity of every card of self.cards
+        """
+        if self.decay == 'linear':
+            # exact integer sums, divided once
+            return ((self.days - self.first_day) @ self.counts) / max(self.last_day - self.first_day, 1)
+        return self.weights() @ self.counts
+
+    def popularity(self) -> Dict[int, float]:
+        """
+        the cards played by the decks of the kept days
+        """
+        if not self.days.size:
+            return {}
+        played = self.counts.any(axis=0)
+        return dict(zip(self.cards[played].tolist(), self.scores()[played].tolist()))
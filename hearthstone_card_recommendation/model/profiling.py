@@ -0,0 +1,114 @@
+import csv
+import json
+import time
+from typing import Dict, List
+
+
+class _Stage:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler: 'Profiler', name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        elapsed = time.perf_counter() - self.start
+        profiler = self.profiler
+        profiler.seconds[self.name] = profiler.seconds.get(self.name, 0.0) + elapsed
+        profiler.calls[self.name] = profiler.calls.get(self.name, 0) + 1
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """
+    Wall time and number of calls of named stages, and named counters.
+    with profiler.stage('predict.synergy'): ...
+    profiler.count('candidates_scored', n)
+    """
+    enabled = True
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self.calls: Dict[str, int] = {}
+        self.counters: Dict[str, int] = {}
+
+    def stage(self, name: str):
+        return _Stage(self, name)
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + int(n)
+
+    def reset(self):
+        self.seconds.clear()
+        self.calls.clear()
+        self.counters.clear()
+
+    def records(self) -> List[Dict]:
+        """
+        one row per stage then per counter: kind, name, calls, seconds, value
+        """
+        stages = [{'kind': 'stage', 'name': name, 'calls': self.calls[name], 'seconds': seconds, 'value': None}
+                  for name, seconds in self.seconds.items()]
+        counters = [{'kind': 'counter', 'name': name, 'calls': None, 'seconds': None, 'value': value}
+                    for name, value in self.counters.items()]
+        return stages + counters
+
+    def export(self, path: str):
+        """
+        .csv for one row per record, json otherwise
+        """
+        records = self.records()
+        with open(path, "w", newline='') as fp:
+            if path.endswith('.csv'):
+                writer = csv.DictWriter(fp, fieldnames=['kind', 'name', 'calls', 'seconds', 'value'])
+                writer.writeheader()
+                writer.writerows(records)
+            else:
+                json.dump(records, fp, indent=2)
+
+    def report(self) -> str:
+        """
+        the stages by decreasing time, then the counters
+        """
+        total = sum(self.seconds.values())
+        lines = [f"{'stage':<28}{'calls':>8}{'seconds':>11}{'share':>8}"]
+        for name, seconds in sorted(self.seconds.items(), key=lambda x: -x[1]):
+            share = seconds / total if total > 0 else 0.0
+            lines.append(f"{name:<28}{self.calls[name]:>8}{seconds:>11.4f}{share:>8.1%}")
+        if self.counters:
+            lines.append(f"{'counter':<28}{'value':>27}")
+            lines.extend(f"{name:<28}{value:>27}" for name, value in self.counters.items())
+        return '\n'.join(lines)
+
+
+class _NullProfiler(Profiler):
+    """
+    the profiler of the models that are not profiled: nothing is recorded
+    """
+    enabled = False
+
+    def stage(self, name: str):
+        return _NULL_STAGE
+
+    def count(self, name: str, n: int = 1):
+        pass
+
+
+NULL_PROFILER = _NullProfiler()
@@ -1,7 +1,12 @@
-from typing import List, Dict, Optional, Set
+from typing import List, Dict, Optional, Set, Union
+import numpy as np
 import pandas as pd
 from .abstract_model import RecommendModel
-from .utility import check_validity
+from .candidates import HeroCandidates
+from .decks import DeckBatch
+from .incidence import CardIncidence
+from .minhash import MinHashIndex
+from .similarity_index import SimilarityIndex
 
 
 def jaccard_similarity_score(a: Set, b: Set) -> float:
@@ -9,47 +14,94 @@ def jaccard_similarity_score(a: Set, b: Set) -> float:
 
 
 class SimilarityModel(RecommendModel):
-    def __init__(self):
-        self.decks: Dict[str, Set] = {}
-        self.cards_profile: Dict[int, Set] = {}
+    """
+    mode 'card': a card is scored by the mean jaccard similarity of its deck profile to the profiles of the deck cards.
+    mode 'deck': a card is scored by the summed jaccard similarity of the k nearest training decks playing it,
+    the neighbours being found approximately by MinHashIndex.
+    """
+    fit_only_attributes = ('decks', 'cards_profile')
+    verbose = True
 
-    def fit(self, data: pd.DataFrame):
+    def __init__(self, batch_size: int = 256, top_k: Optional[int] = None, index_path: Optional[str] = None,
+                 mode: str = 'card', bands: int = 32, rows: int = 4, k: int = 50, bucket_size: int = 256):
+        """
+        top_k: neighbours kept per card in the similarity index, None for the exact dense index on small vocabularies
+        index_path: where the similarity index is saved after fitting (.npz), card mode only
+        bands, rows, bucket_size: recall/speed trade-off of the deck mode, see MinHashIndex
+        k: number of neighbour decks of the deck mode
+        """
+        if mode not in ('card', 'deck'):
+            raise ValueError(f"Unknown SimilarityModel mode {mode}")
+        self.batch_size = batch_size
+        self.top_k = top_k
+        self.index_path = index_path
+        self.mode = mode
+        self.bands = bands
+        self.rows = rows
+        self.k = k
+        self.bucket_size = bucket_size
+        # training decks of the deck mode, one array per partial_fit
+        self.decks: List[np.ndarray] = []
+        self.cards_profile: Optional[CardIncidence] = None
+        self.index: Union[SimilarityIndex, MinHashIndex, None] = None
+        # candidate columns of self.index.cards for every hero
+        self.candidates: Optional[HeroCandidates] = None
+
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        columns: deckid,update_date,hero,card0..28, target
+        """
+        self.decks = []
+        self.cards_profile = None
+        self.partial_fit(data)
+        self.finalize()
+
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
         """
         columns: deckid,update_date,hero,card0..28, target
+        the similarity index is rebuilt by finalize.
+        """
+        data = DeckBatch.coerce(data)
+        with self.profiler.stage('partial_fit'):
+            if self.mode == 'deck':
+                self.decks.append(data.cards)
+            elif self.cards_profile is None:
+                self.cards_profile = CardIncidence.from_decks(data.cards)
+            else:
+                self.cards_profile = self.cards_profile.extend(data.cards)
+        self.profiler.count('decks_fitted', len(data))
+        self.index = None
+
+    def finalize(self):
+        if self.index is not None:
+            return
+        with self.profiler.stage('finalize.index'):
+            if self.mode == 'deck':
+                self.index = MinHashIndex.build(np.concatenate(self.decks), self.bands, self.rows, self.bucket_size)
+            else:
+                self.index = SimilarityIndex.build(self.cards_profile, self.top_k)
+            self.candidates = HeroCandidates(self.index.cards)
+        if self.index_path is not None and self.mode == 'card':
+            self.index.save(self.index_path)
+
+    def load_index(self, path: str):
+        """
+        restore a similarity index saved by fit, predict does not need anything else.
         """
-        for i, row in data.iterrows():
-            cards = row[[f'card{j}' for j in range(29)] + ['target']]
-            deck_id = row['deckid']
-            self.decks[deck_id] = set(cards)
-            for card in cards:
-                if card in self.cards_profile:
-                    self.cards_profile[card].add(deck_id)
-                else:
-                    self.cards_profile[card] = {deck_id}
+        self.index = SimilarityIndex.load(path)
+        self.candidates = HeroCandidates(self.index.cards)
 
-    def predict(self, data: pd.DataFrame) -> List[List[int]]:
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
         """
         columns: deckid,update_date,hero,card0..28
         """
-        pred = []
-        for _, row in data.iterrows():
-            pred.append(self._predict_one([row[f'card{i}'] for i in range(29)], row['hero']))
-            if _ % 10 == 9:
-                print(f'prediction progress {_ + 1} / {data.shape[0]}')
-        return pred
-
-    def _predict_one(self, incomplete_deck: List[int], hero: Optional[str] = None) -> List[int]:
-        rankings = {}
-        for card, profile in self.cards_profile.items():
-            tmp = [jaccard_similarity_score(self.cards_profile[t], profile) for t in list(set(incomplete_deck)) if t != card and t in self.cards_profile]
-            rankings[card] = sum(tmp) / len(tmp)
-
-        top_cards = sorted([(k, v) for k, v in rankings.items()], key=lambda x: x[1],
-                           reverse=True)
-        recommendation = []
-        for card, _ in top_cards:
-            if check_validity(incomplete_deck, card, hero):
-                recommendation.append(card)
-                if len(recommendation) == 3:
-                    break
-        return recommendation
+        data = DeckBatch.coerce(data)
+        self.finalize()
+        self.profiler.count('decks_predicted', len(data))
+        return self._predict_by_hero(data, self.index.cards, self.candidates, self.batch_size, self._score)
+
+    def _score(self, batch: DeckBatch) -> np.ndarray:
+        with self.profiler.stage('predict.score'):
+            if self.mode == 'deck':
+                return self.index.neighbour_scores(batch.incomplete, self.k)
+            return self.index.mean_jaccard(batch.incomplete)
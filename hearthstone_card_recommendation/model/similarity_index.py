@@ -0,0 +1,102 @@
+from typing import Dict, Mapping, Optional, Sequence
+import numpy as np
+import scipy.sparse as sp
+from .incidence import CardIncidence, deck_indicator, average_over_deck
+from .utility import encode_cards
+
+DEFAULT_TOP_K = 256
+MAX_DENSE_CARDS = 4096
+
+
+class SimilarityIndex:
+    """
+    Card-card jaccard similarities computed once at fit time.
+    Small vocabularies keep the full (n_vocab, n_vocab) matrix, large ones only the top_k
+    most similar neighbours of every card. Scoring a deck then only gathers the rows of its cards.
+    """
+    def __init__(self, cards: np.ndarray, similarity, top_k: Optional[int] = None):
+        self.cards = np.asarray(cards, dtype=np.int64)
+        self._sorter = np.argsort(self.cards, kind='stable')
+        self.similarity = similarity
+        self.top_k = top_k
+
+    @property
+    def is_dense(self) -> bool:
+        return not sp.issparse(self.similarity)
+
+    @classmethod
+    def build(cls, incidence: CardIncidence, top_k: Optional[int] = None,
+              block_size: int = 1024) -> 'SimilarityIndex':
+        """
+        top_k: number of neighbours kept per card.
+        None keeps the exact dense matrix if the vocabulary has at most MAX_DENSE_CARDS cards,
+        DEFAULT_TOP_K neighbours otherwise.
+        """
+        n_vocab = incidence.cards.shape[0]
+        if top_k is None and n_vocab > MAX_DENSE_CARDS:
+            top_k = DEFAULT_TOP_K
+        if top_k is not None and top_k >= n_vocab:
+            top_k = None
+        if top_k is None:
+            dense = np.vstack([incidence.jaccard_rows(np.arange(start, min(start + block_size, n_vocab)))
+                               for start in range(0, n_vocab, block_size)]) \
+                if n_vocab else np.zeros((0, 0))
+            return cls(incidence.cards, dense)
+        blocks = []
+        for start in range(0, n_vocab, block_size):
+            similarity = incidence.jaccard_rows(np.arange(start, min(start + block_size, n_vocab)))
+            neighbours = np.argpartition(-similarity, top_k - 1, axis=1)[:, :top_k]
+            values = np.take_along_axis(similarity, neighbours, axis=1)
+            rows = np.repeat(np.arange(similarity.shape[0]), top_k)
+            blocks.append(sp.csr_matrix((values.ravel(), (rows, neighbours.ravel())),
+                                        shape=(similarity.shape[0], n_vocab)))
+        pruned = sp.vstack(blocks, format='csr')
+        pruned.eliminate_zeros()
+        return cls(incidence.cards, pruned, top_k)
+
+    def encode(self, decks: Sequence[Sequence[int]]) -> np.ndarray:
+        return encode_cards(self.cards, self._sorter, decks)
+
+    def candidate_similarity(self, columns: np.ndarray):
+        """
+        the similarities of every card to the cards of columns only
+        """
+        return self.similarity[:, columns]
+
+    def mean_jaccard(self, decks: Sequence[Sequence[int]], columns: Optional[np.ndarray] = None,
+                     similarity=None) -> np.ndarray:
+        """
+        decks: (batch, n_cards) card ids.
+        returns (batch, n_vocab): for every card, the average jaccard similarity between its profile and the profiles
+        of the distinct known cards of the deck, excluding itself. Pruned neighbours count as 0.
+        columns: only the cards of these columns are scored,
+        similarity: their candidate_similarity, computed once for all the batches of the same candidates
+        """
+        query = deck_indicator(self.encode(decks), self.cards.shape[0])
+        if columns is None:
+            return average_over_deck(query, query @ self.similarity)
+        similarity = self.candidate_similarity(columns) if similarity is None else similarity
+        return average_over_deck(query, query @ similarity, columns)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        if self.is_dense:
+            return {'cards': self.cards, 'dense': self.similarity}
+        return {'cards': self.cards, 'data': self.similarity.data, 'indices': self.similarity.indices,
+                'indptr': self.similarity.indptr, 'top_k': np.array(self.top_k)}
+
+    @classmethod
+    def from_arrays(cls, arrays: Mapping[str, np.ndarray]) -> 'SimilarityIndex':
+        cards = arrays['cards']
+        if 'dense' in arrays:
+            return cls(cards, arrays['dense'])
+        similarity = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']),
+                                   shape=(cards.shape[0], cards.shape[0]))
+        return cls(cards, similarity, int(arrays['top_k']))
+
+    def save(self, path: str):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path: str) -> 'SimilarityIndex':
+        with np.load(path) as saved:
+            return cls.from_arrays(saved)
@@ -1,61 +1,78 @@
-from . import RecommendModel
+from .abstract_model import RecommendModel
+import numpy as np
 import pandas as pd
-from typing import List, Dict, Tuple, Optional
-from datetime import datetime
-from .utility import check_validity
+from typing import List, Dict, Tuple, Optional, Union
+from .decks import DeckBatch
+from .popularity import PopularityCounter, Decay
+from .utility import first_valid
 
 
 class SimplePopularity(RecommendModel):
-    def __init__(self):
+    fit_only_attributes = ('counter',)
+
+    def __init__(self, decay: Union[str, Decay] = 'linear', half_life: float = 30.0, window: Optional[int] = None):
+        """
+        decay, half_life, window: recency weight of the decks, see PopularityCounter
+        """
+        self.decay = decay
+        self.half_life = half_life
+        self.window = window
+        self.counter = PopularityCounter(decay, half_life, window)
         self.popularity: Dict[int, float] = {}
 
-    def _update_popularity(self, card: int, w: float):
-        if card not in self.popularity:
-            self.popularity[card] = w
-        else:
-            self.popularity[card] += w
+    def fit(self, data: Union[pd.DataFrame, DeckBatch]):
+        """
+        columns: deckid,update_date,hero,card0..28, target
+        """
+        self.counter = PopularityCounter(self.decay, self.half_life, self.window)
+        self.partial_fit(data)
 
-    def fit(self, data: pd.DataFrame):
+    def partial_fit(self, data: Union[pd.DataFrame, DeckBatch]):
         """
         columns: deckid,update_date,hero,card0..28, target
         """
-        date_begin = datetime.strptime(data['update_date'].min(), '%Y-%m-%d')
-        date_end = datetime.strptime(data['update_date'].max(), '%Y-%m-%d')
-        max_diff_days = (date_end - date_begin).days
-        for i, row in data.iterrows():
-            date = datetime.strptime(row['update_date'], '%Y-%m-%d')
-            diff_days = (date - date_begin).days
-            weight = diff_days / max_diff_days
-            deck = row[[f'card{j}' for j in range(29)] + ['target']].to_list()
-            for card in list(set(deck)):
-                self._update_popularity(card, weight)
-
-    def predict(self, data: pd.DataFrame) -> List[List[int]]:
+        data = DeckBatch.coerce(data)
+        with self.profiler.stage('partial_fit'):
+            self.counter.update(data.cards, data.dates)
+            self.popularity = self.counter.popularity()
+        self.profiler.count('decks_fitted', len(data))
+
+    def set_decay(self, decay: Union[str, Decay], half_life: Optional[float] = None):
+        """
+        recompute the popularity with another decay, from the counts of the fitted decks
+        """
+        self.decay = self.counter.decay = decay
+        if half_life is not None:
+            self.half_life = self.counter.half_life = half_life
+        self.popularity = self.counter.popularity()
+
+    def predict(self, data: Union[pd.DataFrame, DeckBatch]) -> List[List[int]]:
+        data = DeckBatch.coerce(data)
+        self.profiler.count('decks_predicted', len(data))
         ret = []
-        sorted_vocabulary = sorted(self.popularity.items(), key=lambda x: x[1], reverse=True)
-        for i, row in data.iterrows():
-            recommendation = []
-            incomplete_deck = row[[f'card{j}' for j in range(29)]]
-            hero = row['hero']
-            counts = incomplete_deck.value_counts()
-            single_cards = sorted([(c, self.popularity[c]) for c in counts[counts == 1].index], key=lambda x: x[1], reverse=True)
-            incomplete_deck = incomplete_deck.to_list()
-            for c, _ in single_cards:
-                if check_validity(incomplete_deck, c, hero):
-                    recommendation.append(c)
-                    if len(recommendation) == 3:
-                        break
-            if len(recommendation) < 3:
-                for c, _ in sorted_vocabulary:
-                    if check_validity(incomplete_deck, c, hero):
-                        recommendation.append(c)
-                        if len(recommendation) == 3:
-                            break
-            ret.append(recommendation)
+        with self.profiler.stage('predict.sort'):
+            sorted_vocabulary = [c for c, _ in sorted(self.popularity.items(), key=lambda x: x[1], reverse=True)]
+        with self.profiler.stage('predict.rank'):
+            for incomplete_deck, hero in zip(data.incomplete, data.heroes):
+                # cards left out of the popularity window count as 0
+                single_cards = sorted(single_copies(incomplete_deck), key=lambda c: self.popularity.get(c, 0.0),
+                                      reverse=True)
+                incomplete_deck = incomplete_deck.tolist()
+                # single copies first, then the most popular cards
+                recommendation = first_valid(single_cards + sorted_vocabulary, incomplete_deck, hero)
+                ret.append(recommendation)
 
         return ret
 
 
+def single_copies(incomplete_deck: np.ndarray) -> List[int]:
+    """
+    the cards with only one copy in the deck, in order of appearance
+    """
+    cards, first, counts = np.unique(incomplete_deck, return_index=True, return_counts=True)
+    return incomplete_deck[np.sort(first[counts == 1])].tolist()
+
+
 if __name__ == '__main__':
     data = pd.read_csv("../data/data.csv")
     data = data.tail(2000)
\ No newline at end of file
@@ -0,0 +1,50 @@
+from typing import List, Optional, Sequence
+import numpy as np
+
+
+def select_top_k(scores: np.ndarray, mask: Optional[np.ndarray] = None, k: int = 3) -> np.ndarray:
+    """
+    scores: (batch, n) higher is better, mask: (batch, n) entries that can be selected.
+    returns (batch, k) column indices of the k best valid entries of each row, best first,
+    -1 where a row has fewer than k valid entries.
+    Ties are broken by column index, the same as a stable sort in descending order.
+
+    Only a window of the best entries is sorted (np.argpartition). The window is widened for the rows
+    where entries tied with the last one of the window are left out of it.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    batch, n = scores.shape
+    masked = scores if mask is None else np.where(mask, scores, -np.inf)
+    result = np.full((batch, k), -1, dtype=np.int64)
+    rows = np.arange(batch)
+    window = min(k, n)
+    while rows.shape[0] and window > 0:
+        candidates = masked[rows]
+        if window >= n:
+            picks = np.argsort(-candidates, axis=1, kind='stable')[:, :k]
+            values = np.take_along_axis(candidates, picks, axis=1)
+            result[rows, :picks.shape[1]] = np.where(values > -np.inf, picks, -1)
+            break
+        part = np.argpartition(-candidates, window - 1, axis=1)[:, :window]
+        values = np.take_along_axis(candidates, part, axis=1)
+        threshold = values.min(axis=1)
+        n_above = (candidates >= threshold[:, None]).sum(axis=1)
+        done = n_above <= window
+        order = np.lexsort((part[done], -values[done]), axis=-1)[:, :k]
+        picks = np.take_along_axis(part[done], order, axis=1)
+        values = np.take_along_axis(values[done], order, axis=1)
+        result[rows[done], :picks.shape[1]] = np.where(values > -np.inf, picks, -1)
+        rows = rows[~done]
+        if rows.shape[0]:
+            window = int(n_above[~done].max())
+    return result
+
+
+def top_k_cards(cards: Sequence[int], scores: np.ndarray, mask: Optional[np.ndarray] = None,
+                k: int = 3) -> List[List[int]]:
+    """
+    select_top_k mapped to card ids, rows with fewer than k valid cards are shorter
+    """
+    picks = select_top_k(scores, mask, k)
+    cards = np.asarray(cards)
+    return [cards[row[row >= 0]].tolist() for row in picks]
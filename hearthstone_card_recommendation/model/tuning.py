@@ -0,0 +1,99 @@
+import contextlib
+import io
+import itertools
+from multiprocessing import get_context
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from .decks import DeckBatch, NO_CARD
+from .ensemble import EnsembleKnowledge
+from .metrics import hits, reciprocal_ranks
+from .topk import select_top_k
+from .utility import valid_mask_batch
+from . import utility
+
+COMPONENTS = ('synergy', 'mana', 'popularity', 'combo')
+
+
+def weight_grid(values: Dict[str, Sequence[float]]) -> List[Dict[str, float]]:
+    """
+    every combination of the values of each component
+    """
+    return [dict(zip(COMPONENTS, combination)) for combination in itertools.product(*(values[c] for c in COMPONENTS))]
+
+
+def random_weights(n: int, center: Dict[str, float], spread: float = 10.0, seed: int = 0) -> List[Dict[str, float]]:
+    """
+    n weight sets drawn log-uniformly between center / spread and center * spread for every component
+    """
+    rng = np.random.default_rng(seed)
+    factors = np.exp(rng.uniform(-np.log(spread), np.log(spread), size=(n, len(COMPONENTS))))
+    return [{c: center[c] * f for c, f in zip(COMPONENTS, row)} for row in factors.tolist()]
+
+
+def score_weights(model: EnsembleKnowledge, data: DeckBatch, candidates: List[Dict[str, float]],
+                  k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    (n_candidates,) number of hits@k and sum of reciprocal ranks of every weight set over the decks of data.
+    The component matrices of a batch are computed once and recombined for all the weight sets,
+    the recommendations are the ones predict would give with these weights.
+    """
+    model.finalize()
+    n_hits = np.zeros(len(candidates), dtype=np.int64)
+    rr = np.zeros(len(candidates), dtype=np.float64)
+    for rows, columns in model.candidates.groups(data.heroes):
+        cards = model.cards[columns]
+        similarity = model.candidate_similarity(columns)
+        for start in range(0, rows.shape[0], model.batch_size):
+            batch = data[rows[start:start + model.batch_size]]
+            components = model.component_scores(batch, columns, similarity)
+            masks = valid_mask_batch(batch.incomplete, cards, batch.heroes)
+            for i, weights in enumerate(candidates):
+                picks = select_top_k(model.aggregate(components, weights), masks, k)
+                pred = np.where(picks >= 0, cards[picks], NO_CARD)
+                n_hits[i] += hits(pred, batch.target, k).sum()
+                rr[i] += reciprocal_ranks(pred, batch.target, k).sum()
+    return n_hits, rr
+
+
+def fold_bounds(n_decks: int, folds: int) -> List[Tuple[int, int]]:
+    """
+    contiguous validation blocks, the decks being in chronological order
+    """
+    bounds = np.linspace(0, n_decks, folds + 1).astype(int)
+    return list(zip(bounds[:-1].tolist(), bounds[1:].tolist()))
+
+
+def _init_worker(reference_path: str):
+    utility.set_reference_path(reference_path)
+
+
+def _evaluate_fold(task) -> Tuple[np.ndarray, np.ndarray, int]:
+    data, (start, end), candidates, k, model_kwargs = task
+    train = data[np.r_[0:start, end:len(data)]]
+    model = EnsembleKnowledge(**model_kwargs)
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.fit(train)
+    n_hits, rr = score_weights(model, data[start:end], candidates, k)
+    return n_hits, rr, end - start
+
+
+def tune_weights(data: DeckBatch, candidates: List[Dict[str, float]], folds: int = 3, k: int = 3,
+                 workers: int = 1, model_kwargs: Optional[Dict] = None) -> List[Dict]:
+    """
+    cross-validated hit@k and MRR of EnsembleKnowledge for every weight set, best hit@k first.
+    Every fold fits one model on the other folds, the folds run in `workers` processes.
+    """
+    model_kwargs = {} if model_kwargs is None else model_kwargs
+    tasks = [(data, bounds, candidates, k, model_kwargs) for bounds in fold_bounds(len(data), folds)]
+    if workers <= 1:
+        results = [_evaluate_fold(task) for task in tasks]
+    else:
+        with get_context().Pool(min(workers, folds), initializer=_init_worker,
+                                initargs=(utility.REFERENCE_PATH,)) as pool:
+            results = pool.map(_evaluate_fold, tasks)
+    n_decks = sum(n for _, _, n in results)
+    n_hits = sum(h for h, _, _ in results)
+    rr = sum(r for _, r, _ in results)
+    ranking = sorted(range(len(candidates)), key=lambda i: (-n_hits[i], -rr[i]))
+    return [{'weights': candidates[i], 'hit_at_k': float(n_hits[i] / n_decks), 'mrr': float(rr[i] / n_decks)}
+            for i in ranking]
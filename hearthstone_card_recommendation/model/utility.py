@@ -1,18 +1,214 @@
+import json
+import os
+import numpy as np
 import pandas as pd
-from typing import List, Optional, Set
+from typing import List, Optional, Set, Sequence
 
-REFERENCE = pd.read_csv("data/cards.csv", index_col='id')
+# path of the card reference, data/cards.csv of the project whatever the working directory.
+# Can be overridden with the HEARTHSTONE_CARDS environment variable or set_reference_path.
+REFERENCE_PATH = os.environ.get('HEARTHSTONE_CARDS',
+                                os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "cards.csv"))
+_REFERENCE: Optional[pd.DataFrame] = None
+_CARD_TABLE: Optional['CardTable'] = None
+
+
+def encode_cards(cards: np.ndarray, sorter: np.ndarray, decks: Sequence[Sequence[int]]) -> np.ndarray:
+    """
+    map card ids to their position in cards (sorter = argsort(cards)), -1 for unknown cards.
+    """
+    decks = np.asarray(decks, dtype=np.int64)
+    if cards.shape[0] == 0:
+        return np.full(decks.shape, -1, dtype=np.int64)
+    sorted_cards = cards[sorter]
+    pos = np.searchsorted(sorted_cards, decks)
+    pos[pos == sorted_cards.shape[0]] = 0
+    return np.where(sorted_cards[pos] == decks, sorter[pos], -1)
+
+
+def count_copies(codes: np.ndarray, n: int) -> np.ndarray:
+    """
+    codes: (batch, n_cards) positions in [0, n), -1 for unknown cards as given by encode_cards.
+    returns (batch, n + 1) the number of copies of every position in each row, the last column counts the unknown cards
+    """
+    codes = np.where(codes < 0, n, codes) + np.arange(codes.shape[0])[:, None] * (n + 1)
+    return np.bincount(codes.ravel(), minlength=codes.shape[0] * (n + 1)).reshape(codes.shape[0], n + 1)
+
+
+class CardTable:
+    """
+    Card metadata needed by check_validity, as arrays indexed by a dense card id.
+    class_code is -1 for neutral cards, limit is the number of copies allowed in a deck.
+    """
+    NEUTRAL = -1
+    ANY_HERO = -2
+
+    ARRAYS = ('cards', 'class_code', 'limit')
+    # bumped when the arrays built from the same csv change, so that the cached tables are rebuilt
+    VERSION = 2
+
+    def __init__(self, cards: np.ndarray, class_code: np.ndarray, limit: np.ndarray, heroes: List[str]):
+        self.cards = cards
+        self.class_code = class_code
+        self.limit = limit
+        self.heroes = list(heroes)
+        self.hero_index = {h: i for i, h in enumerate(self.heroes)}
+        self._sorter = np.argsort(self.cards, kind='stable')
+
+    @classmethod
+    def from_reference(cls, reference: pd.DataFrame) -> 'CardTable':
+        # the class names of cards.csv come with a leading space
+        classes = reference['class'].str.strip()
+        heroes = sorted(classes.dropna().unique().tolist())
+        class_code = classes.map({h: i for i, h in enumerate(heroes)}).fillna(cls.NEUTRAL).to_numpy(dtype=np.int16)
+        limit = np.where(reference['rarity'].to_numpy() == 'legendary', 1, 2).astype(np.int16)
+        return cls(reference.index.to_numpy(dtype=np.int64), class_code, limit, heroes)
+
+    def save(self, directory: str, stamp: dict):
+        """
+        one .npy file per array so that they can be memory-mapped, the stamp of the source is written last
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        with open(os.path.join(directory, "meta.json"), "w") as fp:
+            json.dump({'heroes': self.heroes, 'source': stamp}, fp)
+
+    @classmethod
+    def load(cls, directory: str, stamp: dict) -> Optional['CardTable']:
+        """
+        memory-map a table saved from the source with the given stamp, None if missing or outdated
+        """
+        try:
+            with open(os.path.join(directory, "meta.json"), "r") as fp:
+                meta = json.load(fp)
+            if meta['source'] != stamp:
+                return None
+            arrays = [np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r') for name in cls.ARRAYS]
+        except (OSError, ValueError, KeyError):
+            return None
+        return cls(*arrays, meta['heroes'])
+
+    def encode(self, cards: Sequence) -> np.ndarray:
+        """
+        dense ids of the cards, -1 for cards missing from the reference
+        """
+        return encode_cards(self.cards, self._sorter, cards)
+
+    def encode_heroes(self, heroes: Sequence[Optional[str]]) -> np.ndarray:
+        """
+        class codes of the heroes, ANY_HERO for None, len(self.heroes) for an unknown hero
+        """
+        return np.array([self.ANY_HERO if h is None else self.hero_index.get(h, len(self.heroes)) for h in heroes],
+                        dtype=np.int16)
+
+    def copies(self, decks: np.ndarray) -> np.ndarray:
+        """
+        (batch, n_cards + 1) number of copies of every card in each deck, the last column counts unknown cards
+        """
+        return count_copies(self.encode(decks), self.cards.shape[0])
+
+    def valid_mask_batch(self, decks: Sequence[Sequence[int]], candidates: Sequence[int],
+                         heroes: Sequence[Optional[str]]) -> np.ndarray:
+        """
+        decks: (batch, n_cards) card ids, candidates: (n_candidates,) card ids, heroes: (batch,)
+        returns a (batch, n_candidates) mask of the candidates that can be added to each deck.
+        Candidates missing from the reference are never valid.
+        """
+        decks = np.asarray(decks, dtype=np.int64).reshape(len(heroes), -1)
+        ids = self.encode(candidates)
+        known = ids >= 0
+        ids = np.where(known, ids, 0)
+        hero_codes = self.encode_heroes(heroes)[:, None]
+        class_code = self.class_code[ids][None, :]
+        class_ok = (class_code == self.NEUTRAL) | (hero_codes == self.ANY_HERO) | (class_code == hero_codes)
+        below_limit = self.copies(decks)[:, ids] < self.limit[ids][None, :]
+        return class_ok & below_limit & known[None, :]
+
+    def valid_mask(self, incomplete_deck: Sequence[int], candidates: Sequence[int],
+                   hero: Optional[str] = None) -> np.ndarray:
+        return self.valid_mask_batch([incomplete_deck], candidates, [hero])[0]
+
+
+def set_reference_path(path: str):
+    """
+    use another card reference, the tables are reloaded on next use
+    """
+    global REFERENCE_PATH, _REFERENCE, _CARD_TABLE
+    REFERENCE_PATH = path
+    _REFERENCE = None
+    _CARD_TABLE = None
+
+
+def get_reference() -> pd.DataFrame:
+    """
+    the full card reference, parsed from REFERENCE_PATH on first use
+    """
+    global _REFERENCE
+    if _REFERENCE is None:
+        _REFERENCE = pd.read_csv(REFERENCE_PATH, index_col='id')
+    return _REFERENCE
+
+
+def _table_cache_dir(path: str) -> str:
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, ".cache", name)
+
+
+def get_card_table() -> CardTable:
+    """
+    the CardTable of REFERENCE_PATH, loaded on first use.
+    The table is cached next to the csv as memory-mapped .npy files and rebuilt when the csv changes.
+    """
+    global _CARD_TABLE
+    if _CARD_TABLE is None:
+        stat = os.stat(REFERENCE_PATH)
+        stamp = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'version': CardTable.VERSION}
+        cache_dir = _table_cache_dir(REFERENCE_PATH)
+        table = CardTable.load(cache_dir, stamp)
+        if table is None:
+            table = CardTable.from_reference(get_reference())
+            try:
+                table.save(cache_dir, stamp)
+            except OSError:
+                # read-only data directory, keep the in-memory table
+                pass
+        _CARD_TABLE = table
+    return _CARD_TABLE
 
 
 def check_validity(incomplete_deck: List[int], card: int, hero: Optional[str] = None) -> bool:
-    global REFERENCE
-    card_info = REFERENCE.loc[card, :]
-    if not pd.isna(card_info['class']) and hero is not None and card_info['class'] != hero:
-        return False
-    if card not in incomplete_deck:
-        return True
-    limit = 1 if card_info['rarity'] == 'legendary' else 2
-    return incomplete_deck.count(card) < limit
+    return bool(get_card_table().valid_mask(incomplete_deck, [card], hero)[0])
+
+
+def valid_mask(incomplete_deck: Sequence[int], candidates: Sequence[int], hero: Optional[str] = None) -> np.ndarray:
+    """
+    vectorized check_validity over all the candidates at once
+    """
+    return get_card_table().valid_mask(incomplete_deck, candidates, hero)
+
+
+def valid_mask_batch(decks: Sequence[Sequence[int]], candidates: Sequence[int],
+                     heroes: Sequence[Optional[str]]) -> np.ndarray:
+    """
+    (batch, n_candidates) validity of the candidates for each deck/hero
+    """
+    return get_card_table().valid_mask_batch(decks, candidates, heroes)
+
+
+def first_valid(ranked_cards: Sequence[int], incomplete_deck: Sequence[int], hero: Optional[str] = None,
+                k: int = 3) -> List[int]:
+    """
+    the first k valid cards of an ordered ranking.
+    Validity is checked on a window at the head of the ranking, doubled until k valid cards are found.
+    """
+    ranked_cards = np.asarray(ranked_cards)
+    window = 4 * k
+    while True:
+        head = ranked_cards[:window]
+        valid = head[valid_mask(incomplete_deck, head, hero)]
+        if valid.shape[0] >= k or window >= ranked_cards.shape[0]:
+            return valid[:k].tolist()
+        window *= 2
 
 
 def jaccard_similarity_score(a: Set, b: Set) -> float:
@@ -2,52 +2,118 @@ import pandas as pd
 import numpy as np
 import json
 import argparse
-from typing import List, Dict, Optional, Tuple, Set
+import cProfile
+import time
+from typing import List, Dict, Optional, Tuple, Set, Iterable, Iterator
 
 from model import *
+from model.metrics import hit_at_k, mean_reciprocal_rank
+from model.parallel import parallel_predict
+from model.tuning import tune_weights, weight_grid, random_weights
 
 
-def create_target(data: pd.DataFrame):
+def create_target(data: pd.DataFrame) -> DeckBatch:
     """
     the data should include the header of card0..card29.
-    this function create samples by turning one of the cards to the target.
+    this function create samples by turning one of the cards to the target,
+    the card at position (index % 30) of each deck.
     """
-    samples = []
-    card_cols = [f'card{i}' for i in range(30)]
-    other_cols = [col for col in data.columns if not col.startswith('card')]
-    for _, row in data.iterrows():
-        deck = row[card_cols].to_list()
-        other_fields = row[other_cols].to_list()
-        for i in range(_ % 30, 30, 30):
-            samples.append(other_fields + deck[:i] + deck[i + 1:] + [deck[i]])
+    cards = data[[f'card{i}' for i in range(30)]].to_numpy(dtype=np.int32)
+    position = data.index.to_numpy() % 30
+    is_target = np.arange(30)[None, :] == position[:, None]
+    return DeckBatch.from_columns(cards[~is_target].reshape(-1, 29), cards[is_target], data['deckid'].to_numpy(),
+                                  data['hero'].to_numpy(), data['update_date'].to_numpy())
 
-    ret = pd.DataFrame(samples, columns=other_cols + card_cols[:-1] + ['target'])
-    return ret
 
+def create_targets(chunks: Iterable[pd.DataFrame]) -> Iterator[DeckBatch]:
+    """
+    create_target over a stream of chunks keeping their original index, e.g. pd.read_csv(..., chunksize=n)
+    """
+    for chunk in chunks:
+        yield create_target(chunk)
+
+
+def hold_out_tail(chunks: Iterable[pd.DataFrame], size: int, tail: List[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """
+    yield the rows of the chunks but the last size ones, which are appended to tail once the chunks are exhausted.
+    """
+    buffer = pd.DataFrame()
+    for chunk in chunks:
+        buffer = chunk if buffer.shape[0] == 0 else pd.concat([buffer, chunk])
+        if buffer.shape[0] > size:
+            yield buffer.head(buffer.shape[0] - size)
+            buffer = buffer.tail(size)
+    tail.append(buffer)
 
-def evaluate(model: RecommendModel, data: pd.DataFrame, test_size: int, final_test: Optional[pd.DataFrame] = None):
+
+def evaluate(model: RecommendModel, data: pd.DataFrame, test_size: int, final_test: Optional[pd.DataFrame] = None,
+             workers: int = 1):
     train_data = data.head(data.shape[0] - test_size)
     test_data = data.tail(test_size)
     train_data = create_target(train_data)
     test_data = create_target(test_data)
     print("fitting starts.")
+    start = time.perf_counter()
     model.fit(train_data)
-    print("fitting finishes. predicting starts.")
-    pred = model.predict(test_data)
+    print(f"fitting finishes in {time.perf_counter() - start:.2f}s. predicting starts.")
+    return predict_and_score(model, test_data, final_test, workers)
+
+
+def evaluate_stream(model: RecommendModel, path: str, test_size: int, chunk_size: int,
+                    final_test: Optional[pd.DataFrame] = None, workers: int = 1):
+    """
+    evaluate without loading the whole csv: the training decks are read chunk by chunk and fed to partial_fit,
+    only the last test_size decks are kept in memory.
+    """
+    tail = []
+    print("fitting starts.")
+    start = time.perf_counter()
+    for train_data in create_targets(hold_out_tail(pd.read_csv(path, chunksize=chunk_size), test_size, tail)):
+        model.partial_fit(train_data)
+    model.finalize()
+    print(f"fitting finishes in {time.perf_counter() - start:.2f}s. predicting starts.")
+    return predict_and_score(model, create_target(tail[0]), final_test, workers)
+
+
+def predict_and_score(model: RecommendModel, test_data: DeckBatch, final_test: Optional[pd.DataFrame] = None,
+                      workers: int = 1):
+    start = time.perf_counter()
+    pred = parallel_predict(model, test_data, workers)
+    elapsed = time.perf_counter() - start
+    print(f"predicted {len(test_data)} decks in {elapsed:.2f}s ({len(test_data) / max(elapsed, 1e-9):.1f} decks/s)")
     if final_test is not None:
-        final_pred = model.predict(final_test)
+        final_pred = parallel_predict(model, final_test, workers)
         output = pd.DataFrame(final_test['deckid'], columns=['deckid'])
         output['recommendations'] = [' '.join([str(c) for c in l]) for l in final_pred]
         output.to_csv("submission.csv", index=None)
-    if test_data is None or test_data.shape[0] == 0:
+    if test_data is None or len(test_data) == 0:
         return 0
-    score = 0
-    for i in range(len(pred)):
-        target = test_data.loc[i, 'target']
-        p = pred[i]
-        if target in p:
-            score += 1
-    return score / len(pred)
+    print(f"MRR@3 {mean_reciprocal_rank(pred, test_data.target):.4f}")
+    return hit_at_k(pred, test_data.target)
+
+
+def tune(data: pd.DataFrame, mode: str, folds: int, trials: int, workers: int = 1, model_kwargs: Optional[Dict] = None):
+    """
+    cross-validated search of the EnsembleKnowledge weights around the current ones.
+    grid: every combination of 0.5, 1 and 2 times each weight, random: `trials` log-uniform draws.
+    The components of weight 0 are searched over 0, 0.5 and 1 in the grid, and around 0.5 by the random draws.
+    """
+    center = EnsembleKnowledge().weights
+    if mode == 'grid':
+        candidates = weight_grid({c: [w * f for f in (0.5, 1.0, 2.0)] if w else [0.0, 0.5, 1.0]
+                                  for c, w in center.items()})
+    else:
+        candidates = [center] + random_weights(trials, {c: w if w else 0.5 for c, w in center.items()})
+    print(f"evaluating {len(candidates)} weight sets over {folds} folds.")
+    start = time.perf_counter()
+    results = tune_weights(create_target(data), candidates, folds, workers=workers, model_kwargs=model_kwargs)
+    print(f"tuning finishes in {time.perf_counter() - start:.2f}s.")
+    current = next(r for r in results if r['weights'] == center)
+    print(f"current weights: hit@3 {current['hit_at_k']:.4f}, MRR@3 {current['mrr']:.4f}")
+    for result in results[:10]:
+        weights = ', '.join(f"{c} {w:.3g}" for c, w in result['weights'].items())
+        print(f"hit@3 {result['hit_at_k']:.4f}, MRR@3 {result['mrr']:.4f}: {weights}")
+    return results
 
 
 if __name__ == '__main__':
@@ -55,8 +121,21 @@ if __name__ == '__main__':
     parser.add_argument('--validation-size', dest='validation_size', type=int, default=200)
     parser.add_argument('--submission', action='store_true')
     parser.add_argument('-m', '--model', dest='model_name', default='EnsembleKnowledge')
+    parser.add_argument('--top-k', dest='top_k', type=int, default=None,
+                        help='neighbours kept per card in the similarity index (SimilarityModel, EnsembleKnowledge)')
+    parser.add_argument('--workers', type=int, default=1, help='number of prediction processes')
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=None,
+                        help='read the training data by chunks of this many decks and fit them with partial_fit')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in every stage of the model (predict stages need --workers 1)')
+    parser.add_argument('--profile-output', dest='profile_output', default=None,
+                        help='save the stage timings and counters, .csv or .json')
+    parser.add_argument('--cprofile', default=None, help='save a cProfile trace of the run (.prof)')
+    parser.add_argument('--tune', choices=['grid', 'random'], default=None,
+                        help='cross-validate EnsembleKnowledge weight sets instead of evaluating a model')
+    parser.add_argument('--folds', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=50, help='number of random weight sets')
     args = parser.parse_args()
-    data = pd.read_csv("data/data_2018.csv")
     if args.submission:
         test = pd.read_csv("data/test.csv")
     else:
@@ -64,5 +143,28 @@ if __name__ == '__main__':
     if args.model_name not in globals():
         print(f"Specified model >{args.model_name}< is not found. Terminating.")
         exit(0)
-    model = globals()[args.model_name]()
-    print(evaluate(model, data, args.validation_size, test))
+    kwargs = {}
+    if args.top_k is not None:
+        kwargs['top_k'] = args.top_k
+    if args.tune is not None:
+        tune(pd.read_csv("data/data_2018.csv"), args.tune, args.folds, args.trials, args.workers, kwargs)
+        exit(0)
+    model = globals()[args.model_name](**kwargs)
+    profiler = model.enable_profiling() if args.profile or args.profile_output is not None else None
+    trace = cProfile.Profile() if args.cprofile is not None else None
+    if trace is not None:
+        trace.enable()
+    if args.chunk_size is None:
+        data = pd.read_csv("data/data_2018.csv")
+        score = evaluate(model, data, args.validation_size, test, args.workers)
+    else:
+        score = evaluate_stream(model, "data/data_2018.csv", args.validation_size, args.chunk_size, test,
+                                args.workers)
+    if trace is not None:
+        trace.disable()
+        trace.dump_stats(args.cprofile)
+    if profiler is not None:
+        print(profiler.report())
+        if args.profile_output is not None:
+            profiler.export(args.profile_output)
+    print(score)
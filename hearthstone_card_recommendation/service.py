@@ -0,0 +1,296 @@
+import argparse
+import asyncio
+import json
+import os
+import pickle
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from model import *
+from model.decks import CARD_COLUMNS, NO_CARD
+from script import create_target, create_targets
+
+
+class LatencyStats:
+    """
+    latency percentiles and throughput over the last `window` requests
+    """
+    def __init__(self, window: int = 100000):
+        self.latencies = deque(maxlen=window)
+        self.completed = deque(maxlen=window)
+        self.batch_sizes = deque(maxlen=window)
+        self.requests = 0
+
+    def record(self, latencies: List[float], completed: float):
+        self.latencies.extend(latencies)
+        self.completed.extend([completed] * len(latencies))
+        self.batch_sizes.append(len(latencies))
+        self.requests += len(latencies)
+
+    def summary(self) -> Dict[str, float]:
+        latencies = np.array(self.latencies) * 1000
+        # from the arrival of the first request of the window to the last response
+        elapsed = self.completed[-1] - (self.completed[0] - self.latencies[0]) if self.completed else 0.0
+        return {'requests': self.requests,
+                'p50_ms': float(np.percentile(latencies, 50)) if latencies.size else 0.0,
+                'p99_ms': float(np.percentile(latencies, 99)) if latencies.size else 0.0,
+                'throughput_per_s': len(self.latencies) / elapsed if elapsed > 0 else 0.0,
+                'mean_batch_size': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.0}
+
+
+def to_batch(decks: List[List[int]], heroes: List[Optional[str]]) -> DeckBatch:
+    cards = np.full((len(decks), 30), NO_CARD, dtype=np.int32)
+    cards[:, :29] = decks
+    heroes = pd.Categorical(heroes)
+    return DeckBatch(cards, np.arange(len(decks)), heroes.codes.astype(np.int16), heroes.categories.tolist(),
+                     np.zeros(len(decks), dtype=np.int32), False)
+
+
+class MicroBatcher:
+    """
+    Coalesce the concurrent single-deck requests into batches for model.predict.
+    A batch is sent as soon as it has max_batch decks, or max_wait seconds after its first request.
+    predict runs in a worker thread, one batch at a time, so that the event loop keeps accepting requests.
+    The progress printing of the model is turned off, so that nothing is written to stdout on every batch.
+    """
+    def __init__(self, model: RecommendModel, max_batch: int = 64, max_wait: float = 0.002):
+        self.model = model
+        self.model.verbose = False
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.stats = LatencyStats()
+        self.queue: Optional[asyncio.Queue] = None
+
+    async def recommend(self, deck: List[int], hero: Optional[str]) -> List[int]:
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((deck, hero, future, time.perf_counter()))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple]:
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        self.queue = asyncio.Queue()
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._next_batch()
+            decks, heroes, futures, received = zip(*batch)
+            try:
+                pred = await loop.run_in_executor(None, self.model.predict, to_batch(list(decks), list(heroes)))
+            except Exception as e:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            now = time.perf_counter()
+            for future, recommendation in zip(futures, pred):
+                if not future.done():
+                    future.set_result([int(c) for c in recommendation])
+            self.stats.record([now - t for t in received], now)
+
+
+async def _read_headers(reader: asyncio.StreamReader) -> Dict[str, str]:
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            return headers
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    request_line = await reader.readline()
+    if not request_line:
+        return None
+    method, path, _ = request_line.decode('latin-1').split(' ', 2)
+    headers = await _read_headers(reader)
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, path, headers, body
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[str, bytes]:
+    status = (await reader.readline()).decode('latin-1').strip()
+    headers = await _read_headers(reader)
+    return status, await reader.readexactly(int(headers['content-length']))
+
+
+def _response(status: str, payload: Dict) -> bytes:
+    body = json.dumps(payload).encode()
+    return (f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+            f"Connection: keep-alive\r\n\r\n").encode() + body
+
+
+class RecommendationService:
+    """
+    Local HTTP endpoint over a fitted model, keep-alive connections.
+    POST /recommend {"cards": [29 card ids], "hero": "mage"} -> {"recommendations": [3 card ids]}
+    GET /stats -> latency percentiles and throughput of the served requests
+    """
+    def __init__(self, model: RecommendModel, max_batch: int = 64, max_wait: float = 0.002):
+        self.batcher = MicroBatcher(model, max_batch, max_wait)
+
+    async def _recommend(self, body: bytes) -> Tuple[str, Dict]:
+        try:
+            request = json.loads(body)
+            deck = [int(c) for c in request['cards']]
+            hero = request.get('hero')
+        except (ValueError, KeyError, TypeError):
+            return "400 Bad Request", {'error': 'expected {"cards": [29 card ids], "hero": name}'}
+        if len(deck) != 29:
+            return "400 Bad Request", {'error': f'expected 29 cards, got {len(deck)}'}
+        try:
+            return "200 OK", {'recommendations': await self.batcher.recommend(deck, hero)}
+        except Exception as e:
+            return "500 Internal Server Error", {'error': repr(e)}
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request = await _read_request(reader)
+                if request is None:
+                    break
+                method, path, headers, body = request
+                if method == 'POST' and path == '/recommend':
+                    status, payload = await self._recommend(body)
+                elif method == 'GET' and path == '/stats':
+                    status, payload = "200 OK", self.batcher.stats.summary()
+                else:
+                    status, payload = "404 Not Found", {'error': f'{method} {path}'}
+                writer.write(_response(status, payload))
+                await writer.drain()
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        batching = asyncio.ensure_future(self.batcher.run())
+        server = await asyncio.start_server(self._handle, host, port)
+        print(f"serving on http://{host}:{port}")
+        async with server:
+            try:
+                await server.serve_forever()
+            finally:
+                batching.cancel()
+                print(json.dumps(self.batcher.stats.summary(), indent=2))
+
+
+def load_model(model_name: str, data_path: str, pickle_path: Optional[str] = None,
+               chunk_size: Optional[int] = None) -> RecommendModel:
+    """
+    the model fitted on all the decks of data_path, or unpickled from pickle_path if it exists.
+    The fitted model is pickled to pickle_path otherwise.
+    """
+    if pickle_path is not None and os.path.exists(pickle_path):
+        with open(pickle_path, "rb") as fp:
+            return pickle.load(fp)
+    model = globals()[model_name]()
+    if chunk_size is None:
+        model.fit(create_target(pd.read_csv(data_path)))
+    else:
+        for train_data in create_targets(pd.read_csv(data_path, chunksize=chunk_size)):
+            model.partial_fit(train_data)
+    model.finalize()
+    if pickle_path is not None:
+        with open(pickle_path, "wb") as fp:
+            pickle.dump(model.fitted_copy(), fp, protocol=pickle.HIGHEST_PROTOCOL)
+    return model
+
+
+async def _client(host: str, port: int, requests: List[bytes], latencies: List[float]):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in requests:
+            start = time.perf_counter()
+            writer.write((f"POST /recommend HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                          f"Content-Length: {len(body)}\r\n\r\n").encode() + body)
+            await writer.drain()
+            status, _ = await _read_response(reader)
+            if ' 200 ' not in status:
+                raise RuntimeError(status)
+            latencies.append(time.perf_counter() - start)
+    finally:
+        writer.close()
+
+
+async def _server_stats(host: str, port: int) -> Dict:
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET /stats HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    await writer.drain()
+    _, body = await _read_response(reader)
+    writer.close()
+    return json.loads(body)
+
+
+async def load_test(host: str, port: int, decks_path: str, n_requests: int, concurrency: int) -> Dict[str, float]:
+    """
+    n_requests single-deck requests sent over `concurrency` connections, each waiting for its previous response.
+    Decks are taken from decks_path in a loop.
+    """
+    decks = pd.read_csv(decks_path)
+    cards = decks[CARD_COLUMNS].to_numpy().tolist()
+    heroes = decks['hero'].tolist()
+    bodies = [json.dumps({'cards': cards[i % len(cards)], 'hero': heroes[i % len(cards)]}).encode()
+              for i in range(n_requests)]
+    latencies: List[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*[_client(host, port, bodies[i::concurrency], latencies) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {'requests': len(latencies), 'concurrency': concurrency,
+            'p50_ms': float(np.percentile(latencies, 50)), 'p99_ms': float(np.percentile(latencies, 99)),
+            'throughput_per_s': len(latencies) / elapsed, 'server': await _server_stats(host, port)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    parser_serve = subparsers.add_parser('serve', help='fit or load a model and serve recommendations')
+    parser_serve.add_argument('-m', '--model', dest='model_name', default='EnsembleKnowledge')
+    parser_serve.add_argument('--data', default="data/data_2018.csv")
+    parser_serve.add_argument('--pickle', dest='pickle_path', default=None,
+                              help='fitted model loaded from this file, written after fitting if missing')
+    parser_serve.add_argument('--chunk-size', dest='chunk_size', type=int, default=None)
+    parser_serve.add_argument('--host', default='127.0.0.1')
+    parser_serve.add_argument('--port', type=int, default=8080)
+    parser_serve.add_argument('--max-batch', dest='max_batch', type=int, default=64)
+    parser_serve.add_argument('--max-wait-ms', dest='max_wait_ms', type=float, default=2.0,
+                              help='time a request waits for others to fill its batch')
+    parser_load = subparsers.add_parser('loadtest', help='send concurrent requests to a running service')
+    parser_load.add_argument('--host', default='127.0.0.1')
+    parser_load.add_argument('--port', type=int, default=8080)
+    parser_load.add_argument('--decks', default="data/test.csv")
+    parser_load.add_argument('--requests', type=int, default=2000)
+    parser_load.add_argument('--concurrency', type=int, default=32)
+    args = parser.parse_args()
+    if args.command == 'serve':
+        if args.model_name not in globals():
+            print(f"Specified model >{args.model_name}< is not found. Terminating.")
+            exit(0)
+        model = load_model(args.model_name, args.data, args.pickle_path, args.chunk_size)
+        service = RecommendationService(model, args.max_batch, args.max_wait_ms / 1000)
+        try:
+            asyncio.run(service.serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print(json.dumps(asyncio.run(load_test(args.host, args.port, args.decks, args.requests, args.concurrency)),
+                         indent=2))
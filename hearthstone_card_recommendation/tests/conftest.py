@@ -0,0 +1,18 @@
+import os
+import sys
+import pandas as pd
+import pytest
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the scripts run from the package directory: `from model import *` and data/ paths relative to it
+sys.path.insert(0, PACKAGE_DIR)
+
+
+@pytest.fixture(autouse=True)
+def package_dir(monkeypatch):
+    monkeypatch.chdir(PACKAGE_DIR)
+
+
+@pytest.fixture(scope='session')
+def decks() -> pd.DataFrame:
+    return pd.read_csv(os.path.join(PACKAGE_DIR, "data", "test.csv"))
@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+from model import (DeckBatch, EnsembleKnowledge, MatrixFactorization, NaiveGraph, SimilarityModel,
+                   SimplePopularity)
+
+MODELS = {
+    'NaiveGraph': lambda: NaiveGraph(export_path=None),
+    'NaiveGraph-dict': lambda: NaiveGraph(backend='dict', export_path=None),
+    'SimplePopularity': lambda: SimplePopularity(),
+    'SimilarityModel': lambda: SimilarityModel(),
+    'SimilarityModel-deck': lambda: SimilarityModel(mode='deck'),
+    'EnsembleKnowledge': lambda: EnsembleKnowledge(cache_dir=None),
+    'MatrixFactorization': lambda: MatrixFactorization(embeddings_dir=None),
+}
+
+
+@pytest.mark.parametrize('name', list(MODELS))
+def test_chunked_partial_fit_equals_fit(name, decks):
+    train = DeckBatch.from_frame(decks.head(600))
+    test = DeckBatch.from_frame(decks.tail(100))
+    one_shot = MODELS[name]()
+    one_shot.verbose = False
+    one_shot.fit(train)
+    chunked = MODELS[name]()
+    chunked.verbose = False
+    for start in range(0, len(train), 250):
+        chunked.partial_fit(train[np.arange(start, min(start + 250, len(train)))])
+    chunked.finalize()
+    assert chunked.predict(test) == one_shot.predict(test)
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+from model.topk import select_top_k, top_k_cards
+
+
+def reference_top_k(scores: np.ndarray, mask: np.ndarray, k: int) -> np.ndarray:
+    """ the former per-deck full sort: stable sort in descending order, then the first k valid entries """
+    result = np.full((scores.shape[0], k), -1, dtype=np.int64)
+    for i, (row, valid) in enumerate(zip(scores, mask)):
+        order = np.argsort(-row, kind='stable')
+        picks = order[valid[order]][:k]
+        result[i, :picks.shape[0]] = picks
+    return result
+
+
+@pytest.mark.parametrize('n', [1, 3, 10, 200])
+@pytest.mark.parametrize('k', [1, 3, 5])
+def test_select_top_k_breaks_ties_like_a_stable_sort(n, k):
+    rng = np.random.default_rng(n * 10 + k)
+    # few distinct values so that the window boundary often falls inside a run of ties
+    scores = rng.integers(0, 4, size=(64, n)).astype(np.float64)
+    mask = rng.random((64, n)) < 0.7
+    np.testing.assert_array_equal(select_top_k(scores, mask, k), reference_top_k(scores, mask, k))
+    np.testing.assert_array_equal(select_top_k(scores, None, k), reference_top_k(scores, np.ones_like(mask), k))
+
+
+def test_top_k_cards_shortens_rows_with_few_valid_cards():
+    scores = np.array([[1.0, 3.0, 2.0, 3.0], [5.0, 4.0, 3.0, 2.0]])
+    mask = np.array([[True, True, True, True], [False, True, False, False]])
+    assert top_k_cards([10, 11, 12, 13], scores, mask) == [[11, 13, 12], [11]]
@@ -0,0 +1,65 @@
+import numpy as np
+import pandas as pd
+from model.decks import DeckBatch
+from model.incidence import CardIncidence
+from model.similarity_index import SimilarityIndex
+from model.utility import REFERENCE_PATH, jaccard_similarity_score, valid_mask_batch
+
+
+def check_validity_reference(reference: pd.DataFrame, incomplete_deck, card, hero) -> bool:
+    """ the former pandas check_validity, on the stripped class names """
+    card_info = reference.loc[card, :]
+    if not pd.isna(card_info['class']) and hero is not None and card_info['class'].strip() != hero:
+        return False
+    if card not in incomplete_deck:
+        return True
+    limit = 1 if card_info['rarity'] == 'legendary' else 2
+    return incomplete_deck.count(card) < limit
+
+
+def profiles(decks: np.ndarray):
+    """ the former set-based profiles: the decks that include every card """
+    result = {}
+    for i, deck in enumerate(decks.tolist()):
+        for card in deck:
+            result.setdefault(card, set()).add(i)
+    return result
+
+
+def test_valid_mask_batch_matches_check_validity(decks):
+    reference = pd.read_csv(REFERENCE_PATH, index_col='id')
+    batch = DeckBatch.from_frame(decks.head(40))
+    heroes = batch.heroes[:-1] + [None]
+    candidates = np.unique(batch.incomplete)
+    candidates = candidates[np.isin(candidates, reference.index)]
+    mask = valid_mask_batch(batch.incomplete, candidates, heroes)
+    for deck, hero, row in zip(batch.incomplete.tolist(), heroes, mask):
+        assert row.tolist() == [check_validity_reference(reference, deck, c, hero) for c in candidates.tolist()]
+
+
+def test_incidence_jaccard_matches_sets(decks):
+    cards = DeckBatch.from_frame(decks.head(300)).incomplete
+    incidence = CardIncidence.from_decks(cards)
+    by_card = profiles(cards)
+    assert incidence.cards.tolist() == list(by_card)
+    rows = np.arange(0, incidence.cards.shape[0], 7)
+    similarity = incidence.jaccard_rows(rows)
+    for row, values in zip(rows.tolist(), similarity):
+        a = by_card[int(incidence.cards[row])]
+        expected = [0.0 if j == row else jaccard_similarity_score(a, by_card[int(c)])
+                    for j, c in enumerate(incidence.cards)]
+        np.testing.assert_allclose(values, expected)
+
+
+def test_mean_jaccard_matches_sets(decks):
+    cards = DeckBatch.from_frame(decks.head(300)).incomplete
+    index = SimilarityIndex.build(CardIncidence.from_decks(cards))
+    by_card = profiles(cards)
+    queries = DeckBatch.from_frame(decks.tail(5)).incomplete
+    scores = index.mean_jaccard(queries)
+    for deck, row in zip(queries.tolist(), scores):
+        known = {c for c in deck if c in by_card}
+        for j, card in enumerate(index.cards.tolist()):
+            others = known - {card}
+            expected = sum(jaccard_similarity_score(by_card[card], by_card[c]) for c in others) / len(others)
+            assert np.isclose(row[j], expected)
@@ -1,51 +1,42 @@
-import pandas as pd
+import argparse
 import json
-from typing import List, Dict
+import numpy as np
+from typing import List, Set, Tuple
 
+from hearthstone_card_recommendation.model.clustering import sweep_clusters, cluster_members
 
-def find_clusters(links: pd.Series):
-    adj_graph: Dict[int, List[int]] = {}
-    all_nodes = set()
-    for key, value in links.items():
-        comma = str(key).find(',')
-        c1 = int(key[1:comma])
-        c2 = int(key[comma + 1:-1])
-        all_nodes.add(c1)
-        all_nodes.add(c2)
-        if c1 in adj_graph:
-            adj_graph[c1].append(c2)
-        else:
-            adj_graph[c1] = [c2]
-        if c2 in adj_graph:
-            adj_graph[c2].append(c1)
-        else:
-            adj_graph[c2] = [c1]
-    # find spanning trees
-    all_trees = []
-    while all_nodes:
-        tree = set()
-        q = {list(all_nodes)[0]}
-        r = set()
-        tree = tree.union(q)
-        while q:
-            node = list(q)[0]
-            linked_nodes = set(adj_graph[node])
-            linked_nodes = linked_nodes.difference(r)
-            tree = tree.union(linked_nodes)
-            q = q.union(linked_nodes)
-            q.remove(node)
-            r.add(node)
-        all_nodes = all_nodes.difference(tree)
-        all_trees.append(tree)
-        print(tree)
-    return all_trees
+
+def load_edges(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    the (c1, c2, weight) edge arrays of the NaiveGraph export, either .npz or the former .json dict
+    """
+    if path.endswith('.json'):
+        with open(path) as fp:
+            naive_graph = json.load(fp)
+        pairs = np.array([key[1:-1].split(',') for key in naive_graph.keys()], dtype=np.int64).reshape(-1, 2)
+        return pairs[:, 0], pairs[:, 1], np.array(list(naive_graph.values()), dtype=np.float64)
+    with np.load(path) as edges:
+        return edges['c1'], edges['c2'], edges['weight']
+
+
+def find_clusters(c1: np.ndarray, c2: np.ndarray, weight: np.ndarray, threshold: float) -> List[Set[int]]:
+    """
+    the combo clusters: cards connected by links heavier than threshold
+    """
+    clusters = sweep_clusters(c1, c2, weight, [threshold])[threshold]
+    return [set(members.tolist()) for members in cluster_members(clusters)]
 
 
 if __name__ == '__main__':
-    with open("src/hearthstone_card_recommendation/data/naive_graph.json") as fp:
-        naive_graph = json.load(fp)
-    links = pd.Series(naive_graph, name='link')
-    threshold = 650
-    links = links[links > threshold]
-    print(links.shape)
-    print(len(find_clusters(links)))
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph', default="src/hearthstone_card_recommendation/data/naive_graph.npz")
+    parser.add_argument('--thresholds', type=float, nargs='+', default=[650])
+    parser.add_argument('--verbose', action='store_true', help='print the clusters')
+    args = parser.parse_args()
+    c1, c2, weight = load_edges(args.graph)
+    for threshold, clusters in sweep_clusters(c1, c2, weight, args.thresholds).items():
+        members = cluster_members(clusters)
+        print(f"threshold {threshold}: {int((weight > threshold).sum())} links, {len(members)} clusters")
+        if args.verbose:
+            for cluster in members:
+                print(set(cluster.tolist()))
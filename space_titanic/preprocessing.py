@@ -0,0 +1,182 @@
+import glob
+import os
+import shutil
+from typing import Dict, Iterator
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+
+CHUNK_SIZE = 100000
+
+# fixed categories, so that every chunk is encoded the same way. Other values raise a ValueError.
+CATEGORIES = {
+    'HomePlanet': ['Earth', 'Europa', 'Mars'],
+    'Destination': ['TRAPPIST-1e', 'PSO J318.5-22', '55 Cancri e'],
+    'Cabin_0': ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'T'],
+    'Cabin_2': ['P', 'S'],
+}
+SPEND_COLUMNS = ['RoomService', 'FoodCourt', 'ShoppingMall', 'Spa', 'VRDeck']
+CABIN_COLUMNS = ['Cabin_0', 'Cabin_1', 'Cabin_2']
+
+# dtypes of the preprocessed columns, Transported only in train
+DTYPES = {
+    'PassengerId': 'string',
+    'HomePlanet': pd.CategoricalDtype(CATEGORIES['HomePlanet']),
+    'CryoSleep': 'boolean',
+    'Destination': pd.CategoricalDtype(CATEGORIES['Destination']),
+    'Age': 'float32',
+    'VIP': 'boolean',
+    **{c: 'float32' for c in SPEND_COLUMNS},
+    'Name': 'string',
+    'Transported': 'boolean',
+    'Cabin_0': pd.CategoricalDtype(CATEGORIES['Cabin_0']),
+    'Cabin_1': 'Int32',
+    'Cabin_2': pd.CategoricalDtype(CATEGORIES['Cabin_2']),
+}
+# dtypes the raw columns are parsed with, the categorical ones as strings checked by encode_categories
+READ_DTYPES = {**{c: 'string' if c in CATEGORIES else t for c, t in DTYPES.items() if c not in CABIN_COLUMNS},
+               'Cabin': 'string'}
+
+
+def split_cabin(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Cabin deck/number/side replaced by Cabin_0, Cabin_1 and Cabin_2 at the end of the columns
+    """
+    cabin = data['Cabin'].str.split('/', n=2, expand=True).reindex(columns=range(3))
+    cabin.columns = CABIN_COLUMNS
+    cabin = cabin.astype({'Cabin_0': 'string', 'Cabin_1': 'Int32', 'Cabin_2': 'string'})
+    return pd.concat([data.drop(columns='Cabin'), cabin], axis=1)
+
+
+def encode_categories(data: pd.DataFrame) -> pd.DataFrame:
+    """
+    the columns of CATEGORIES as categoricals, a ValueError for the values outside of their categories
+    rather than losing them as missing values
+    """
+    data = data.copy()
+    for name in CATEGORIES:
+        encoded = data[name].astype(DTYPES[name])
+        unknown = encoded.isna() & data[name].notna()
+        if unknown.any():
+            values = sorted(data.loc[unknown, name].unique().tolist())
+            raise ValueError(f"{name}: values {values} are not in CATEGORIES, add them to be encoded")
+        data[name] = encoded
+    return data
+
+
+def read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> Iterator[pd.DataFrame]:
+    """
+    the preprocessed chunks of a raw train or test csv
+    """
+    with pd.read_csv(path, dtype=READ_DTYPES, chunksize=chunk_size) as reader:
+        for chunk in reader:
+            yield encode_categories(split_cabin(chunk))
+
+
+def _column_arrays(name: str, column: pd.Series) -> Dict[str, np.ndarray]:
+    """
+    plain numpy arrays of a column: categorical codes, values and a mask of the missing values otherwise
+    """
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return {name: column.cat.codes.to_numpy(dtype=np.int8)}
+    if column.dtype == 'float32':
+        return {name: column.to_numpy()}
+    missing = column.isna().to_numpy()
+    if column.dtype == 'string':
+        values = column.fillna('').to_numpy(dtype=str)
+    else:
+        values = column.to_numpy(dtype=column.dtype.numpy_dtype, na_value=0)
+    return {name: values, f"{name}.missing": missing}
+
+
+def _column_from_arrays(name: str, arrays) -> pd.Series:
+    dtype = DTYPES[name]
+    if isinstance(dtype, pd.CategoricalDtype):
+        return pd.Series(pd.Categorical.from_codes(arrays[name], dtype=dtype), name=name)
+    if dtype == 'float32':
+        return pd.Series(arrays[name], name=name)
+    values = pd.Series(arrays[name], name=name).astype(dtype)
+    return values.mask(arrays[f"{name}.missing"])
+
+
+class ColumnWriter:
+    """
+    Columnar binary copy of the preprocessed chunks, for fast reloads with load_preprocessed.
+    A parquet file when pyarrow is installed, otherwise a directory of .npz parts, one per chunk.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self.parts = 0
+        self._writer = None
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        elif os.path.exists(path):
+            os.remove(path)
+        if pyarrow is None:
+            os.makedirs(path)
+
+    def write(self, chunk: pd.DataFrame):
+        if pyarrow is not None:
+            table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema)
+            self._writer.write_table(table)
+        else:
+            arrays = {}
+            for name in chunk.columns:
+                arrays.update(_column_arrays(name, chunk[name]))
+            np.savez(os.path.join(self.path, f"part-{self.parts:05d}.npz"), **arrays)
+        self.parts += 1
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+def binary_path(csv_path: str) -> str:
+    """
+    data/train_.csv -> data/train_.parquet, or the data/train_ directory of .npz parts without pyarrow
+    """
+    stem = os.path.splitext(csv_path)[0]
+    return f"{stem}.parquet" if pyarrow is not None else stem
+
+
+def preprocess(input_path: str, output_path: str, binary: bool = True, chunk_size: int = CHUNK_SIZE) -> int:
+    """
+    preprocess a raw csv chunk by chunk into output_path, and into binary_path(output_path) if binary.
+    returns the number of rows
+    """
+    writer = ColumnWriter(binary_path(output_path)) if binary else None
+    rows = 0
+    try:
+        for chunk in read_chunks(input_path, chunk_size):
+            chunk.to_csv(output_path, index=False, mode='w' if rows == 0 else 'a', header=rows == 0)
+            if writer is not None:
+                writer.write(chunk)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def load_preprocessed(path: str) -> pd.DataFrame:
+    """
+    a preprocessed file with the dtypes of DTYPES: the csv, the parquet file or the directory of .npz parts
+    """
+    if path.endswith('.csv'):
+        columns = pd.read_csv(path, nrows=0).columns
+        return pd.read_csv(path, dtype={c: DTYPES[c] for c in columns})
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    frames = []
+    for part in sorted(glob.glob(os.path.join(path, "part-*.npz"))):
+        with np.load(part) as arrays:
+            names = [name for name in arrays.files if not name.endswith('.missing')]
+            frames.append(pd.concat([_column_from_arrays(name, arrays) for name in names], axis=1))
+    return pd.concat(frames, ignore_index=True)
@@ -1,15 +1,28 @@
-import pandas as pd
-import numpy as np
-import json
-from typing import List, Dict, Optional, Tuple, Set
+import argparse
+import os
+import time
 
+from preprocessing import CHUNK_SIZE, binary_path, preprocess
 
-if __name__ == '__main__':
-    data = pd.read_csv("data/test.csv")
-    cabin = data['Cabin'].apply(lambda s: [] if pd.isna(s) else s.split('/'))
-    data['Cabin_0'] = cabin.apply(lambda s: s[0] if s else None)
-    data['Cabin_1'] = cabin.apply(lambda s: s[1] if s else None)
-    data['Cabin_2'] = cabin.apply(lambda s: s[2] if s else None)
-    data.drop('Cabin', inplace=True, axis=1)
-    data.to_csv("data/test_.csv", index=None)
 
+def output_path(input_path: str) -> str:
+    """
+    data/test.csv -> data/test_.csv
+    """
+    stem, ext = os.path.splitext(input_path)
+    return f"{stem}_{ext}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='split Cabin and compact the dtypes of the passenger csv files')
+    parser.add_argument('inputs', nargs='*', default=["data/train.csv", "data/test.csv"])
+    parser.add_argument('--chunk-size', dest='chunk_size', type=int, default=CHUNK_SIZE)
+    parser.add_argument('--no-binary', dest='binary', action='store_false',
+                        help='only write the csv, not the columnar copy')
+    args = parser.parse_args()
+    for path in args.inputs:
+        start = time.perf_counter()
+        output = output_path(path)
+        rows = preprocess(path, output, args.binary, args.chunk_size)
+        written = f"{output} and {binary_path(output)}" if args.binary else output
+        print(f"{path}: {rows} rows written to {written} in {time.perf_counter() - start:.2f}s")